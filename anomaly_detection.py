@@ -1,5 +1,46 @@
+import os
+import threading
+import warnings
+
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+FEATURE_NAMES = ["overall_rate", "rate_last_7", "rate_last_3", "longest_miss_streak", "current_miss_streak"]
+
+def history_features(adherence_histories, streak_cap=7):
+    """
+    Turn ragged adherence histories into fixed-length feature vectors.
+    adherence_histories: list of lists/arrays of 0/1, any lengths
+    Returns: (N, 5) array of [overall_rate, rate_last_7, rate_last_3,
+             longest_miss_streak, current_miss_streak], streaks scaled by streak_cap
+    """
+    n = len(adherence_histories)
+    width = max((len(h) for h in adherence_histories), default=0)
+    if n == 0 or width == 0:
+        return np.zeros((n, len(FEATURE_NAMES)))
+    # Right-align so the last column is every patient's most recent dose
+    X = np.full((n, width), np.nan)
+    for i, h in enumerate(adherence_histories):
+        if len(h):
+            X[i, width - len(h):] = h
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows (empty histories)
+        overall = np.nanmean(X, axis=1)
+        last_7 = np.nanmean(X[:, -7:], axis=1)
+        last_3 = np.nanmean(X[:, -3:], axis=1)
+    # Run lengths of consecutive misses, resetting at every taken (or missing) dose
+    missed = X == 0
+    count = np.cumsum(missed, axis=1)
+    run = count - np.maximum.accumulate(np.where(~missed, count, 0), axis=1)
+    longest = run.max(axis=1)
+    current = run[:, -1]
+    features = np.column_stack([
+        overall, last_7, last_3,
+        np.minimum(longest, streak_cap) / streak_cap,
+        np.minimum(current, streak_cap) / streak_cap,
+    ])
+    # Patients with no history look fully adherent
+    return np.nan_to_num(features, nan=1.0)
 
 def detect_anomalies_kmeans(adherence_histories, n_clusters=2, threshold=1.5):
     """
@@ -7,7 +48,7 @@ def detect_anomalies_kmeans(adherence_histories, n_clusters=2, threshold=1.5):
     adherence_histories: list of lists/arrays (each patient's adherence history)
     Returns: list of bools (True if anomalous)
     """
-    X = np.array(adherence_histories)
+    X = history_features(adherence_histories)
     if len(X) < n_clusters:
         # Not enough samples for clustering; return all False (no anomalies)
         return [False] * len(X)
@@ -20,6 +61,107 @@ def detect_anomalies_kmeans(adherence_histories, n_clusters=2, threshold=1.5):
     anomalies = distances > (threshold * median_dist)
     return anomalies.tolist()
 
+class AnomalyEngine:
+    """
+    Anomaly detection for large cohorts. Histories are reduced to fixed-length
+    features, clusters are learned incrementally with MiniBatchKMeans, and the
+    cluster centres are persisted, so scoring a patient is O(k) and nothing is
+    refit on page render.
+    """
+
+    def __init__(self, n_clusters=2, threshold=1.5, batch_size=1024, random_state=42):
+        self.n_clusters = n_clusters
+        self.threshold = threshold
+        self.kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state, n_init=3)
+        self.centers = None
+        self.median_dist = None
+        self.n_fitted = 0  # histories seen so far
+        self.fitted_keys = set()  # patients (e.g. contacts) whose histories have been learned from
+        self.lock = threading.Lock()
+
+    def partial_fit(self, adherence_histories, keys=None):
+        """
+        Update cluster centres (and the typical distance) with more histories.
+        keys, if given, identify the patients, so callers can skip ones already learned from.
+        """
+        X = history_features(adherence_histories)
+        if len(X) == 0:
+            return self
+        with self.lock:
+            if self.centers is None and len(X) < self.n_clusters:
+                return self  # wait for enough samples to initialise the clusters
+            if keys is not None:
+                self.fitted_keys.update(keys)
+            self.kmeans.partial_fit(X)
+            self.centers = self.kmeans.cluster_centers_.copy()
+            batch_median = float(np.median(self._distances(X)))
+            # Running average of the median distance, weighted by samples seen
+            total = self.n_fitted + len(X)
+            self.median_dist = batch_median if self.median_dist is None else (
+                self.median_dist * self.n_fitted + batch_median * len(X)) / total
+            self.n_fitted = total
+        return self
+
+    def _distances(self, X):
+        # Distance to the nearest of the k centres
+        return np.sqrt(((X[:, None, :] - self.centers[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+
+    def score(self, adherence_histories):
+        """Distance of each history to its nearest cluster centre."""
+        return self._distances(history_features(adherence_histories))
+
+    def detect(self, adherence_histories):
+        """List of bools (True if anomalous); all False until the engine has been fit."""
+        if self.centers is None:
+            return [False] * len(adherence_histories)
+        return (self.score(adherence_histories) > self.threshold * self.median_dist).tolist()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centers=self.centers, median_dist=self.median_dist, n_fitted=self.n_fitted,
+                 threshold=self.threshold, fitted_keys=np.array(sorted(self.fitted_keys), dtype=str))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Engine with saved centres; it can score new patients without refitting."""
+        data = np.load(path)
+        engine = cls(n_clusters=len(data["centers"]), threshold=float(data["threshold"]))
+        engine.centers = data["centers"]
+        engine.median_dist = float(data["median_dist"])
+        engine.n_fitted = int(data["n_fitted"])
+        engine.fitted_keys = set(data["fitted_keys"].tolist()) if "fitted_keys" in data else set()
+        # Seed MiniBatchKMeans with the saved centres so partial_fit continues from them
+        engine.kmeans.set_params(init=engine.centers, n_init=1)
+        return engine
+
+ANOMALY_MODEL_PATH = os.getenv("TIBA_ANOMALY_MODEL", os.path.join("models", "anomaly_centers.npz"))
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_anomaly_engine(path=ANOMALY_MODEL_PATH):
+    """Shared engine, loaded from saved centres if there are any."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AnomalyEngine.load(path) if os.path.exists(path) else AnomalyEngine()
+        return _engine
+
+def detect_cohort_anomalies(adherence_histories, keys, path=ANOMALY_MODEL_PATH):
+    """
+    Score a cohort with the shared engine. keys identify each history's patient
+    (e.g. contact); patients the engine hasn't learned from yet update the
+    centres, which are then saved.
+    """
+    engine = get_anomaly_engine(path)
+    new = [i for i, key in enumerate(keys) if key not in engine.fitted_keys]
+    if new:
+        engine.partial_fit([adherence_histories[i] for i in new], [keys[i] for i in new])
+        if engine.centers is not None:
+            engine.save(path)
+    return engine.detect(adherence_histories)
+
 # Example usage:
 if __name__ == "__main__":
     histories = [
@@ -29,6 +171,10 @@ if __name__ == "__main__":
         [1,1,1,0,1,1,0],
         [1,1,1,1,1,1,0],
         [0,1,0,1,0,1,0],
+        [1,1,1],
+        [0,0,1,1,1,1,1,1,1,1,1,1,1,1],
     ]
     anomalies = detect_anomalies_kmeans(histories)
-    print("Anomalies:", anomalies) 
\ No newline at end of file
+    print("Anomalies:", anomalies)
+    engine = AnomalyEngine().partial_fit(histories, keys=range(len(histories)))
+    print("Engine anomalies:", engine.detect(histories))
@@ -1,21 +1,92 @@
 import streamlit as st
 import pandas as pd
-from mock_db import add_patient, get_patients, add_schedule, get_schedules, add_feedback, get_feedback
-from ml_model import predict_nonadherence, risk_trend, detect_anomalies, predict_adherence_risk, predict_dropout_risk, suggest_interventions
+import numpy as np
+from mock_db import add_patient, get_patients, add_schedule, get_schedules, add_feedback, get_feedback_page, count_feedback, data_version, sync_feedback
+from ml_model import build_feature_matrix, predict_adherence_risk_batch, predict_dropout_risk_batch, suggest_interventions
 import datetime
 from translate import translate
 import scheduler
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import re
-from forecasting import forecast_adherence_arima
-from feedback_analysis import analyze_feedback
-from anomaly_detection import detect_anomalies_kmeans
+from forecasting import forecast_many
+from risk_engine import engine as risk_engine
+from feedback_store import store as feedback_store
+from dose_index import index as dose_index, current_slot
+from feedback_analysis import analyze_feedback_batch
+from anomaly_detection import detect_cohort_anomalies
 from scheduler import recommend_optimal_time
 import altair as alt
+from model_registry import latest_version
+from validation import COUNTRIES, LANGUAGES, validate_registration
+from bulk_import import import_registrations
 
-# Supported countries and languages
-COUNTRIES = ["Kenya", "Uganda", "Tanzania", "Rwanda"]
-LANGUAGES = ["English", "Swahili", "Kinyarwanda", "Luganda"]
+PAGE_SIZES = [10, 25, 50, 100]
+
+def page_controls(total, key, page_size):
+    """Render page controls for 'total' items and return the offset of the visible page."""
+    pages = max(1, -(-total // page_size))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    if total:
+        st.caption(f"Showing {start + 1}–{min(start + page_size, total)} of {total}")
+    return start
+
+def paginate(items, key, page_size):
+    """Render page controls and return only the visible page of items."""
+    start = page_controls(len(items), key, page_size)
+    return items[start:start + page_size]
+
+def risk_band(risk):
+    return "High" if risk >= 0.66 else ("Medium" if risk >= 0.33 else "Low")
+
+# --- Cached dashboard computations ---
+# Each is keyed by the mock_db.data_version of the data it depends on, so reruns
+# triggered by widgets reuse the results and only new data recomputes them.
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_risk_scores(patient_version, feedback_version, day, model_version):
+    patients = get_patients()
+    # Feature matrix [recent_adherence_rate, age, num_medications, feedback_count] for all patients
+    # Feedback counts for the last 7 days come from a scan of the columnar feedback store,
+    # synced first so it holds at least everything up to feedback_version (the cache key)
+    feedback_store.sync()
+    recent_counts = feedback_store.counts_since(datetime.now() - timedelta(days=7))
+    X_patients = build_feature_matrix(patients, feedback_counts=recent_counts)
+    risk_probs, risk_labels, importance = predict_adherence_risk_batch(X_patients)
+    # Dropout features: [recent_adherence_rate, negative_feedback_count]
+    X_dropout = np.column_stack([
+        X_patients[:, 0],
+        [patient.get('negative_feedback_count', 0) for patient in patients],
+    ])
+    dropout_probs, dropout_labels = predict_dropout_risk_batch(X_dropout)
+    return risk_probs, risk_labels, importance, dropout_probs, dropout_labels
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_forecasts(patient_version):
+    # ARIMA fits run in parallel and are cached by history, so unchanged patients aren't refit
+    histories = [patient.get('adherence_history', [1, 1, 0, 1, 1, 0, 1]) for patient in get_patients()]
+    return forecast_many(histories, steps=7)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_feedback_analysis(feedback_version, count=10):
+    # Newest 'count' entries, oldest first
+    return analyze_feedback_batch([feedback.get('text', '') for feedback in reversed(get_feedback_page(count))])
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_kmeans_anomalies(patient_version):
+    # Assume adherence_histories is a list of all patients' adherence histories
+    patients = get_patients()
+    adherence_histories = [p.get('adherence_history', [1,1,1,1,1,1,1]) for p in patients]
+    # Scored against persisted cluster centres; only patients not seen before update them
+    return detect_cohort_anomalies(adherence_histories, [p['contact'] for p in patients])
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_recommendations(patient_version):
+    recommendations = []
+    for patient in get_patients():
+        history = patient.get('adherence_history', [1, 0, 1, 0, 1, 1])
+        times = patient.get('dose_times', ['8am', '8pm', '8am', '8pm', '8am', '8pm'])
+        recommendations.append(recommend_optimal_time(history, times))
+    return recommendations
 
 # --- Sidebar ---
 st.set_page_config(page_title="Tiba Kwa Wakati", layout="wide", page_icon="💊")
@@ -82,47 +153,49 @@ with tabs[1]:
             med_time = st.time_input("⏰ Time (24-hour format)", value=time(8,0))
             num_medications = st.number_input("Number of Medications", min_value=1, max_value=20, value=1)
         submitted = st.form_submit_button("Register Patient")
-        errors = []
         if submitted:
-            if not name:
-                errors.append("Patient Name is required.")
-            if not contact:
-                errors.append("Phone Number is required.")
-            if not country:
-                errors.append("Country is required.")
-            if not language:
-                errors.append("Language is required.")
+            # Same validation as bulk import; the phone number is normalized to E.164
+            patient, sched, errors = validate_registration({
+                "name": name,
+                "contact": contact,
+                "country": country,
+                "language": language,
+                "medication": medication,
+                "time": med_time,
+                "start_date": start_date,
+                "age": age,
+                "num_medications": num_medications,
+            })
             if medication_select == "Other (type below)" and not custom_med:
+                errors = [e for e in errors if e != "Medication name is required."]
                 errors.append("Please enter the medication name if it's not in the list.")
-            if not med_time:
-                errors.append("Time is required.")
-            if not start_date:
-                errors.append("Start Date is required.")
             if errors:
                 for err in errors:
                     st.error(err)
             else:
-                hour = med_time.hour
-                minute = med_time.minute
-                schedule_str = f"{hour:02d}:{minute:02d}"
-                patient = {
-                    "name": name,
-                    "contact": contact,
-                    "country": country,
-                    "language": language,
-                    "age": age,
-                    "num_medications": num_medications,
-                }
                 add_patient(patient)
-                sched = {
-                    "patient_contact": contact,
-                    "medication": medication,
-                    "schedule": schedule_str,
-                    "start_date": str(start_date),
-                }
                 add_schedule(sched)
                 st.success(f"✅ Registered {name} for {medication} reminders starting {start_date} at {med_time.strftime('%I:%M')}.")
     st.markdown("---")
+    st.subheader("📥 Bulk Import")
+    st.caption("CSV or Excel file with one row per patient and medication: name, contact, country, medication, "
+               "time (HH:MM, comma-separated for several doses), and optionally language, start_date, age, num_medications.")
+    upload = st.file_uploader("Patient list", type=["csv", "xlsx"])
+    if upload is not None and st.button("Import Patients"):
+        status = st.empty()
+        def show_progress(stats):
+            status.info(f"Processed {stats['rows']} rows: {stats['patients_added']} patients, "
+                        f"{stats['schedules_added']} schedules added")
+        try:
+            stats = import_registrations(upload, filename=upload.name, progress=show_progress)
+        except (ValueError, RuntimeError) as e:
+            st.error(f"Import failed: {e}")
+        else:
+            status.success(f"✅ Imported {stats['patients_added']} patients and {stats['schedules_added']} schedules "
+                           f"from {stats['rows']} rows ({stats['duplicates']} duplicate contacts, {stats['invalid']} invalid).")
+            for row_number, errors in stats["errors"]:
+                st.warning(f"Row {row_number}: {' '.join(errors)}")
+    st.markdown("---")
     st.subheader("👥 Registered Patients")
     patients = get_patients()
     if patients:
@@ -144,11 +217,13 @@ with tabs[2]:
     st.header("📊 Healthcare Worker Dashboard")
     patients = get_patients()
     schedules = get_schedules()
-    feedback_log = get_feedback()
+    patient_version, feedback_version = data_version("patient", "feedback")
+    # Apply feedback written since the last run, including by the webhook process, in one pass
+    sync_feedback(risk_engine, feedback_store, dose_index)
 
     # Filters
     with st.expander("🔎 Filter Patients", expanded=True):
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
             country_filter = st.selectbox("🌍 Country", ["All"] + COUNTRIES)
         with col2:
@@ -156,16 +231,19 @@ with tabs[2]:
         with col3:
             medications = list({s['medication'] for s in schedules})
             med_filter = st.selectbox("💊 Medication", ["All"] + medications)
+        with col4:
+            page_size = st.selectbox("📄 Patients per page", PAGE_SIZES)
     filtered_patients = [p for p in patients if (country_filter == "All" or p["country"] == country_filter) and (language_filter == "All" or p["language"] == language_filter)]
 
     # Metrics
     st.markdown("---")
     st.subheader("📈 Adherence Metrics")
     total_patients = len(filtered_patients)
-    total_feedback = len(feedback_log)
+    total_feedback = len(feedback_store)  # the columnar store already holds every feedback record
+    # Risk, trend and anomalies are kept up to date incrementally by the risk engine
     avg_risk = 0.0
     if total_patients > 0:
-        avg_risk = sum([predict_nonadherence(p["contact"], feedback_log) for p in filtered_patients]) / total_patients
+        avg_risk = sum([risk_engine.risk(p["contact"]) for p in filtered_patients]) / total_patients
     col1, col2, col3 = st.columns(3)
     col1.metric("👥 Patients", total_patients)
     col2.metric("📝 Feedback Entries", total_feedback)
@@ -174,12 +252,15 @@ with tabs[2]:
     # Feedback log table
     st.markdown("---")
     st.subheader("📝 Feedback Log")
-    if feedback_log:
-        df_feedback = pd.DataFrame(feedback_log)
-        if med_filter != "All":
-            df_feedback = df_feedback[df_feedback["medication"] == med_filter]
-        if country_filter != "All":
-            df_feedback = df_feedback[df_feedback["patient_contact"].isin([p["contact"] for p in filtered_patients])]
+    # Newest first, one page at a time, filtered in the storage query
+    feedback_medication = None if med_filter == "All" else med_filter
+    feedback_contacts = None
+    if country_filter != "All" or language_filter != "All":
+        feedback_contacts = [p["contact"] for p in filtered_patients]
+    feedback_total = count_feedback(feedback_medication, feedback_contacts)
+    if feedback_total:
+        start = page_controls(feedback_total, "feedback", page_size)
+        df_feedback = pd.DataFrame(get_feedback_page(page_size, start, feedback_medication, feedback_contacts))
         st.dataframe(df_feedback, use_container_width=True)
     else:
         st.info("No feedback logged yet.")
@@ -187,44 +268,63 @@ with tabs[2]:
     # Risk levels and adherence trends
     st.markdown("---")
     st.subheader("⚠️ Adherence Risk & Trends")
-    for patient in filtered_patients:
-        risk = predict_nonadherence(patient["contact"], feedback_log)
+    # Summarise the whole cohort; render details only for the visible page
+    current_risks = {p["contact"]: risk_engine.risk(p["contact"]) for p in filtered_patients}
+    band_counts = pd.Series([risk_band(r) for r in current_risks.values()], dtype=object).value_counts()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("🔴 High risk", int(band_counts.get("High", 0)))
+    col2.metric("🟡 Medium risk", int(band_counts.get("Medium", 0)))
+    col3.metric("🟢 Low risk", int(band_counts.get("Low", 0)))
+    col1, col2 = st.columns(2)
+    with col1:
+        risk_view = st.radio("Show", ["Top worst patients", "All patients (paged)"], horizontal=True, key="risk_view")
+    with col2:
+        risk_sort = st.selectbox("Sort by", ["Risk (highest first)", "Risk (lowest first)", "Name"], key="risk_sort")
+    if risk_sort == "Name":
+        sorted_patients = sorted(filtered_patients, key=lambda p: p["name"])
+    else:
+        sorted_patients = sorted(filtered_patients, key=lambda p: current_risks[p["contact"]], reverse=risk_sort == "Risk (highest first)")
+    if risk_view == "Top worst patients":
+        # A slider needs min < max, so only offer one when there is a choice to make
+        top_k = len(filtered_patients)
+        if top_k > 1:
+            top_k = st.slider("Number of patients", min_value=1, max_value=min(100, top_k), value=min(10, top_k), key="risk_top_k")
+        worst = {p["contact"] for p in sorted(filtered_patients, key=lambda p: current_risks[p["contact"]], reverse=True)[:top_k]}
+        # The K highest-risk patients, listed in the chosen sort order
+        visible_patients = [p for p in sorted_patients if p["contact"] in worst]
+    else:
+        visible_patients = paginate(sorted_patients, "risk", page_size)
+    for patient in visible_patients:
+        patient_risk = risk_engine.summary(patient["contact"])
+        risk = patient_risk["risk"]
         color = "🟢" if risk < 0.33 else ("🟡" if risk < 0.66 else "🔴")
         st.markdown(f"**{patient['name']} ({patient['contact']})** - Risk: {color} <span style='font-size:1.2em'>{round(risk,2)}</span>", unsafe_allow_html=True)
-        trend = risk_trend(patient["contact"], feedback_log)
+        trend = patient_risk["trend"]
         if trend:
             trend_df = pd.DataFrame(trend, columns=["Timestamp", "Risk"])
             st.line_chart(trend_df.set_index("Timestamp"))
         # Show recent feedback for this patient
-        patient_feedback = [f for f in feedback_log if f["patient_contact"] == patient["contact"]]
+        patient_feedback = get_feedback_page(5, contacts=[patient["contact"]])
         if patient_feedback:
             with st.expander("Recent Feedback", expanded=False):
-                st.dataframe(pd.DataFrame(patient_feedback).tail(5), use_container_width=True)
+                st.dataframe(pd.DataFrame(patient_feedback[::-1]), use_container_width=True)
         # Anomaly detection alerts
-        anomalies = detect_anomalies(patient["contact"], feedback_log)
+        anomalies = patient_risk["anomalies"]
         if anomalies:
             for ts, desc in anomalies:
                 st.warning(f"🚨 Anomaly detected on {ts}: {desc}")
         # Feedback logging form for each medication
-        patient_schedules = [s for s in schedules if s["patient_contact"] == patient["contact"]]
+        patient_schedules = get_schedules(patient["contact"])
         for sched in patient_schedules:
             # Use contact, schedule time, and start date as unique form key
             safe_schedule = re.sub(r'[^a-zA-Z0-9]', '_', sched['schedule'])
             safe_date = re.sub(r'[^a-zA-Z0-9]', '_', sched.get('start_date', ''))
             form_key = f"feedback_{patient['contact']}_{safe_schedule}_{safe_date}"
-            # Only show feedback form if no feedback exists for today for this patient/medication/schedule
-            today = datetime.now().date().isoformat()
-            feedback_exists = any(
-                f["patient_contact"] == patient["contact"] and
-                f["medication"] == sched["medication"] and
-                f["timestamp"].startswith(today) and
-                sched["schedule"] in form_key and
-                safe_date in form_key
-                for f in feedback_log
-            )
-            if not feedback_exists:
+            # Only show feedback form if this dose hasn't been logged today (O(1) dose index lookup)
+            slot = current_slot(sched)
+            if not dose_index.logged(patient["contact"], sched["medication"], slot):
                 with st.form(form_key, clear_on_submit=True):
-                    st.write(f"Log feedback for **{sched['medication']}** at {sched['schedule']}:")
+                    st.write(f"Log feedback for **{sched['medication']}** at {slot}:")
                     response = st.selectbox("Did the patient take the medication?", ["yes", "no", "delay"])
                     submitted = st.form_submit_button("Log Feedback")
                     if submitted:
@@ -233,37 +333,32 @@ with tabs[2]:
                             "medication": sched["medication"],
                             "timestamp": datetime.now().isoformat(),
                             "response": response,
+                            "slot": slot,
                         }
                         add_feedback(feedback)
                         st.success("Feedback logged.")
                         # st.experimental_rerun()  # Removed due to AttributeError in current Streamlit version
         st.markdown("---")
 
+    st.header("Missed Doses Today")
+    # Read straight from the dose index: doses due over an hour ago answered 'no' or not at all
+    dose_index.sync()  # including feedback logged above in this run
+    missed = dose_index.missed_doses(schedules)
+    if missed:
+        names = {p["contact"]: p["name"] for p in patients}
+        df_missed = pd.DataFrame(missed)
+        df_missed.insert(0, "Patient", df_missed["patient_contact"].map(names))
+        st.metric("Missed doses", len(df_missed))
+        st.dataframe(df_missed, use_container_width=True)
+    else:
+        st.success("No missed doses so far today.")
+
     st.header("Advanced Adherence Prediction (All Patients)")
+    risk_probs, risk_labels, importance, dropout_probs, dropout_labels = cached_risk_scores(
+        patient_version, feedback_version, datetime.now().date().isoformat(), latest_version())
     risk_data = []
     feature_importances = {}
-    for patient in patients:
-        # Calculate recent adherence rate
-        adherence_history = patient.get('adherence_history', [])
-        if adherence_history:
-            recent_adherence_rate = sum(adherence_history[-7:]) / min(len(adherence_history), 7)
-        else:
-            recent_adherence_rate = 0.0
-        # Calculate feedback count in last 7 days
-        feedback_count = 0
-        now = datetime.now()
-        for feedback in feedback_log:
-            if feedback.get('patient_contact') == patient['contact']:
-                ts = feedback.get('timestamp')
-                if ts and isinstance(ts, datetime) and (now - ts).days < 7:
-                    feedback_count += 1
-        features = [
-            recent_adherence_rate,
-            patient.get('age', 40),
-            patient.get('num_medications', 2),
-            feedback_count
-        ]
-        prob, label, importance = predict_adherence_risk(features)
+    for patient, prob, label in zip(patients, risk_probs, risk_labels):
         risk_data.append({'Patient': patient['name'], 'Risk Probability': prob, 'Risk Level': 'High' if label else 'Low'})
         feature_importances[patient['name']] = importance
 
@@ -281,8 +376,14 @@ with tabs[2]:
 
     df_risk['RiskColor'] = df_risk['Risk Probability'].apply(risk_color)
     color_scale = alt.Scale(domain=['High', 'Medium', 'Low'], range=['red', 'orange', 'green'])
+    col1, col2, col3 = st.columns(3)
+    col1.metric("High", int((df_risk['RiskColor'] == 'High').sum()))
+    col2.metric("Medium", int((df_risk['RiskColor'] == 'Medium').sum()))
+    col3.metric("Low", int((df_risk['RiskColor'] == 'Low').sum()))
 
-    chart = alt.Chart(df_risk).mark_bar().encode(
+    # Chart only the worst patients; the full cohort is in the table below
+    df_top_risk = df_risk.head(page_size)
+    chart = alt.Chart(df_top_risk).mark_bar().encode(
         x=alt.X('Risk Probability:Q', scale=alt.Scale(domain=[0, 1])),
         y=alt.Y('Patient:N', sort='-x'),
         color=alt.Color('RiskColor:N', scale=color_scale, legend=alt.Legend(title="Risk Level")),
@@ -302,8 +403,8 @@ with tabs[2]:
 
     st.dataframe(df_risk.style.applymap(color_risk, subset=['Risk Probability']))
 
-    # Expanders for per-patient feature importance
-    for patient in df_risk['Patient']:
+    # Expanders for per-patient feature importance (worst patients only)
+    for patient in df_top_risk['Patient']:
         with st.expander(f"Feature Importance for {patient}"):
             imp = feature_importances[patient]
             sorted_imp = sorted(imp.items(), key=lambda x: x[1], reverse=True)
@@ -311,20 +412,16 @@ with tabs[2]:
                 st.write(f"- {fname}: {score:.2f}")
 
     st.header("Personalized Adherence Forecast (All Patients)")
-    forecast_dict = {}
-    for patient in patients:
-        history = patient.get('adherence_history', [1, 1, 0, 1, 1, 0, 1])
-        forecast = forecast_adherence_arima(history, steps=7)
-        forecast_dict[patient['name']] = forecast
+    forecasts = cached_forecasts(patient_version)
+    forecast_dict = {patient['name']: forecast for patient, forecast in zip(patients, forecasts)}
     if forecast_dict:
         df_forecast = pd.DataFrame(forecast_dict)
         df_forecast.index = [f"Day {i+1}" for i in range(7)]
         st.line_chart(df_forecast)
 
     st.header("Recent Patient Feedback Analysis")
-    # Example: assume feedback_log is a list of dicts with 'patient', 'text', and 'timestamp'
-    for feedback in feedback_log[-10:]:  # Show last 10 feedback entries
-        analysis = analyze_feedback(feedback.get('text', ''))
+    recent_feedback = get_feedback_page(10)[::-1]  # Show last 10 feedback entries, oldest first
+    for feedback, analysis in zip(recent_feedback, cached_feedback_analysis(feedback_version)):
         st.subheader(f"Feedback from {feedback['patient_contact']} at {feedback['timestamp']}")
         st.write(f"Text: {feedback.get('text', '')}")
         st.write(f"Sentiment: {analysis['sentiment']} (polarity: {analysis['polarity']:.2f})")
@@ -333,31 +430,15 @@ with tabs[2]:
             st.markdown("**:red[Flagged for review]**")
 
     st.header("Anomaly & Event Detection")
-    # Assume adherence_histories is a list of all patients' adherence histories
-    adherence_histories = [p.get('adherence_history', [1,1,1,1,1,1,1]) for p in patients]
-    anomalies = detect_anomalies_kmeans(adherence_histories)
+    anomalies = cached_kmeans_anomalies(patient_version)
     for patient, is_anomaly in zip(patients, anomalies):
         if is_anomaly:
             st.warning(f"Anomaly detected in adherence for {patient['name']}")
 
     st.header("Predictive Analytics & Interventions")
-    for patient in patients:
-        # Calculate recent adherence rate
-        adherence_history = patient.get('adherence_history', [])
-        if adherence_history:
-            recent_adherence_rate = sum(adherence_history[-7:]) / min(len(adherence_history), 7)
-        else:
-            recent_adherence_rate = 0.0
-        # Calculate feedback count in last 7 days
-        feedback_count = 0
-        now = datetime.now()
-        for feedback in feedback_log:
-            if feedback.get('patient_contact') == patient['contact']:
-                ts = feedback.get('timestamp')
-                if ts and isinstance(ts, datetime) and (now - ts).days < 7:
-                    feedback_count += 1
-        negative_feedback_count = patient.get('negative_feedback_count', 0)
-        prob, label = predict_dropout_risk(recent_adherence_rate, negative_feedback_count)
+    dropout_rows = sorted(zip(patients, dropout_probs, dropout_labels), key=lambda row: row[1], reverse=True)
+    st.metric("High dropout/complication risk", int(sum(label for _, _, label in dropout_rows)), help=f"of {len(dropout_rows)} patients")
+    for patient, prob, label in paginate(dropout_rows, "dropout", page_size):
         st.subheader(f"Patient: {patient['name']}")
         st.write(f"Dropout/complication risk: {prob:.2f} ({'High' if label else 'Low'})")
         feedback_analysis = patient.get('last_feedback_analysis', {'intents': []})
@@ -367,10 +448,10 @@ with tabs[2]:
             st.write(f"- {intervention}")
 
     st.header("AI-Driven Scheduling Recommendations")
-    for patient in patients:
-        history = patient.get('adherence_history', [1, 0, 1, 0, 1, 1])
-        times = patient.get('dose_times', ['8am', '8pm', '8am', '8pm', '8am', '8pm'])
-        recommended_time = recommend_optimal_time(history, times)
+    recommendations = list(zip(patients, cached_recommendations(patient_version)))
+    if recommendations:
+        st.bar_chart(pd.Series([t for _, t in recommendations]).value_counts())
+    for patient, recommended_time in paginate(recommendations, "recommendations", page_size):
         st.write(f"Recommended optimal time for {patient['name']}: {recommended_time}")
 
 # --- Footer ---
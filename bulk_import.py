@@ -0,0 +1,168 @@
+# bulk_import.py
+import argparse
+import os
+import time
+from datetime import date
+
+import pandas as pd
+
+from mock_db import add_patients_many, add_schedules_many, get_patients_by_contact, get_schedules_by_contact
+from validation import validate_registration
+
+# Accepted spellings of each column (headers are lower-cased, spaces -> underscores)
+COLUMN_ALIASES = {
+    "name": ["name", "patient_name", "patient"],
+    "contact": ["contact", "phone", "phone_number", "msisdn"],
+    "country": ["country"],
+    "language": ["language", "preferred_language"],
+    "medication": ["medication", "medication_name", "drug"],
+    "time": ["time", "times", "schedule", "dose_time", "dose_times"],
+    "start_date": ["start_date", "start"],
+    "age": ["age"],
+    "num_medications": ["num_medications", "number_of_medications"],
+}
+REQUIRED_COLUMNS = ["name", "contact", "country", "medication", "time"]
+MAX_REPORTED_ERRORS = 100  # keep the error list bounded on huge files
+
+
+def _column_map(columns):
+    normalized = {str(c).strip().lower().replace(" ", "_"): c for c in columns}
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                mapping[field] = normalized[alias]
+                break
+    return mapping
+
+
+def _is_excel(name):
+    return str(name).lower().endswith((".xlsx", ".xlsm"))
+
+
+def read_chunks(source, chunk_size=10000, filename=None):
+    """
+    Yield DataFrames of up to chunk_size rows from a CSV or Excel (.xlsx) file
+    path or file-like object, without loading the whole file.
+    """
+    if _is_excel(filename or source):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError("Excel import needs openpyxl (pip install openpyxl); or save the sheet as CSV.")
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield pd.DataFrame(chunk, columns=header)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def import_registrations(source, filename=None, chunk_size=10000, dry_run=False, progress=None):
+    """
+    Stream patients and medication schedules from a CSV/Excel file into storage.
+    Each row is one patient + medication (name, contact, country, language,
+    medication, time, start_date, optional age and num_medications) and goes
+    through the Register form's validation. Patients are deduplicated by
+    normalized contact, against storage and within the file; extra rows for a
+    known contact only add schedules, and schedules already stored are skipped. Every chunk is written with one batched
+    insert per table before the next is read, so only the current chunk is held in memory: rows are deduplicated
+    within the chunk and against storage (one lookup per chunk), which already has the earlier chunks. In a dry run
+    nothing is written, so duplicates across chunks aren't counted. progress(stats) is called after each chunk.
+    Returns a stats dict.
+    """
+    stats = {"rows": 0, "patients_added": 0, "schedules_added": 0, "duplicates": 0, "invalid": 0, "errors": []}
+    started = time.monotonic()
+    for chunk in read_chunks(source, chunk_size, filename):
+        columns = _column_map(chunk.columns)
+        missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+        if missing:
+            raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+        defaults = {}
+        if "language" not in columns:
+            defaults["language"] = "English"
+        if "start_date" not in columns:
+            defaults["start_date"] = date.today().isoformat()
+        valid = []
+        renamed = chunk[list(columns.values())].rename(columns={v: k for k, v in columns.items()})
+        for offset, record in enumerate(renamed.to_dict("records")):
+            row_number = stats["rows"] + offset + 2  # 1-based, after the header row
+            if all(value is None or str(value).strip() == "" for value in record.values()):
+                continue  # blank line
+            patient, sched, errors = validate_registration({**defaults, **record})
+            if errors:
+                stats["invalid"] += 1
+                if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                    stats["errors"].append((row_number, errors))
+                continue
+            valid.append((patient, sched))
+        contacts = {patient["contact"] for patient, _ in valid}
+        stored = get_patients_by_contact(contacts)
+        # Schedules already stored aren't re-added (e.g. from an earlier import of the same file)
+        seen_contacts = set(stored)
+        seen_schedules = {
+            (contact, s["medication"], s["schedule"])
+            for contact, stored_schedules in get_schedules_by_contact(contacts).items()
+            for s in stored_schedules
+        }
+        patients, schedules = [], []
+        for patient, sched in valid:
+            contact = patient["contact"]
+            if contact in seen_contacts:
+                stats["duplicates"] += 1
+            else:
+                seen_contacts.add(contact)
+                patients.append(patient)
+            schedule_key = (contact, sched["medication"], sched["schedule"])
+            if schedule_key in seen_schedules:
+                continue
+            seen_schedules.add(schedule_key)
+            schedules.append(sched)
+        stats["rows"] += len(chunk)
+        if not dry_run:
+            add_patients_many(patients)
+            add_schedules_many(schedules)
+        stats["patients_added"] += len(patients)
+        stats["schedules_added"] += len(schedules)
+        stats["seconds"] = time.monotonic() - started
+        if progress:
+            progress(stats)
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import patients and medication schedules from CSV or Excel.")
+    parser.add_argument("path", help="CSV or .xlsx file with one row per patient + medication")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--dry-run", action="store_true", help="Validate and count without writing")
+    args = parser.parse_args()
+    if os.getenv("TIBA_STORAGE", "memory") == "memory" and not args.dry_run:
+        print("[IMPORT] Warning: TIBA_STORAGE is 'memory', so imported data is lost on exit. Use TIBA_STORAGE=sqlite.")
+
+    def report(stats):
+        print(f"[IMPORT] {stats['rows']} rows: {stats['patients_added']} patients, {stats['schedules_added']} schedules, "
+              f"{stats['duplicates']} duplicate contacts, {stats['invalid']} invalid ({stats['seconds']:.1f}s)")
+
+    stats = import_registrations(args.path, chunk_size=args.chunk_size, dry_run=args.dry_run, progress=report)
+    for row_number, errors in stats["errors"]:
+        print(f"[IMPORT ERROR] Row {row_number}: {' '.join(errors)}")
+    if stats["invalid"] > len(stats["errors"]):
+        print(f"[IMPORT ERROR] ... and {stats['invalid'] - len(stats['errors'])} more invalid rows")
+    report(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# dispatcher.py
+import heapq
+import json
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from messaging import deliver
+from metrics import counter, histogram
+
+# Per-channel limits: max in-flight requests and sustained sends per second
+DEFAULT_CONCURRENCY = {"SMS": 20, "WhatsApp": 10, "Voice": 5}
+DEFAULT_RATES = {"SMS": 30.0, "WhatsApp": 20.0, "Voice": 5.0}
+
+send_seconds = histogram("tiba_send_seconds", "Transport latency per send attempt")
+messages_sent = counter("tiba_messages_sent_total", "Messages delivered")
+send_errors = counter("tiba_send_errors_total", "Failed send attempts")
+
+
+class TokenBucket:
+    """Allows 'rate' acquisitions per second with bursts of up to 'capacity'."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TwilioTransport:
+    """Sends through messaging.deliver (Twilio, or the console mock without credentials)."""
+
+    def send(self, channel, phone, message):
+        deliver(channel, phone, message)
+
+
+class FakeTransport:
+    """In-process transport for tests: simulated latency and failures, records what was sent."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, channel, phone, message):
+        with self.lock:
+            fail = self.random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError(f"Simulated {channel} failure")
+        with self.lock:
+            self.sent.append((channel, phone, message))
+
+
+class FakeTwilioServer:
+    """
+    Local HTTP server standing in for the Twilio API in tests. Accepts JSON POSTs
+    of {channel, to, body}, with optional latency and failure rate.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.received = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:
+                    fail = server.random.random() < server.failure_rate
+                    if not fail:
+                        server.received.append(payload)
+                self.send_response(503 if fail else 201)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/messages"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class HttpTransport:
+    """Posts messages as JSON to an HTTP endpoint, e.g. a FakeTwilioServer."""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, channel, phone, message):
+        data = json.dumps({"channel": channel, "to": phone, "body": message}).encode()
+        request = urllib.request.Request(self.url, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass  # non-2xx responses raise HTTPError
+
+
+class Dispatcher:
+    """
+    Sends reminders in parallel. Each channel has its own thread pool sized to its
+    concurrency limit and its own token-bucket rate limit, so a backlog on a slow
+    channel (Voice) never holds up the others. Failed sends are retried with
+    exponential backoff from a timer thread, so a message waiting to retry holds
+    no worker; submit() blocks once max_pending messages are queued so memory
+    stays bounded during peaks.
+    """
+
+    def __init__(self, transport=None, concurrency=None, rates=None, max_retries=3,
+                 backoff=0.5, max_pending=1000):
+        self.transport = transport or TwilioTransport()
+        concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        rates = {**DEFAULT_RATES, **(rates or {})}
+        self.executors = {
+            channel: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"dispatch-{channel}")
+            for channel, n in concurrency.items()
+        }
+        self.rates = rates
+        self.buckets = {channel: TokenBucket(rate) for channel, rate in rates.items()}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.retries = []  # heap of (due, seq, channel, phone, message, attempt, future)
+        self.retry_seq = 0
+        self.retry_ready = threading.Condition()
+        self.closed = False
+        self.retry_thread = threading.Thread(target=self._run_retries, name="dispatch-retries", daemon=True)
+        self.retry_thread.start()
+
+    def set_rate_share(self, processes):
+        """Send at 1/processes of the configured rates, when that many processes share one provider account."""
+        for channel, rate in self.rates.items():
+            self.buckets[channel].set_rate(rate / max(1, processes))
+
+    def _finish(self, future, result=None, error=None):
+        self.pending.release()
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _attempt(self, channel, phone, message, attempt, future):
+        while True:
+            self.buckets[channel].acquire()
+            try:
+                with send_seconds.time(channel=channel):
+                    self.transport.send(channel, phone, message)
+            except Exception as e:
+                send_errors.inc(channel=channel)
+                if attempt >= self.max_retries:
+                    print(f"[DISPATCH {channel} ERROR] {phone}: {e}")
+                    self._finish(future, error=e)
+                    return
+                attempt += 1
+                # Wait for the retry off the pool, so the worker can send other messages meanwhile
+                delay = self.backoff * 2 ** (attempt - 1) * (0.5 + random.random())
+                with self.retry_ready:
+                    if not self.closed:
+                        self.retry_seq += 1
+                        heapq.heappush(self.retries, (time.monotonic() + delay, self.retry_seq, channel, phone, message, attempt, future))
+                        self.retry_ready.notify()
+                        return
+                continue  # shutting down: retry straight away
+            messages_sent.inc(channel=channel)
+            self._finish(future, True)
+            return
+
+    def _run_retries(self):
+        with self.retry_ready:
+            while not (self.closed and not self.retries):
+                if not self.retries:
+                    self.retry_ready.wait()
+                    continue
+                wait = self.retries[0][0] - time.monotonic()
+                if wait > 0 and not self.closed:
+                    self.retry_ready.wait(wait)
+                    continue
+                _, _, channel, phone, message, attempt, future = heapq.heappop(self.retries)
+                try:
+                    self.executors[channel].submit(self._attempt, channel, phone, message, attempt, future)
+                except RuntimeError as e:  # shut down without waiting
+                    self._finish(future, error=e)
+
+    def submit(self, channel, phone, message):
+        """Queue one message. Returns a Future that resolves to True or raises the last error."""
+        if channel not in self.executors:
+            raise ValueError(f"Unknown channel: {channel}")
+        self.pending.acquire()
+        future = Future()
+        try:
+            self.executors[channel].submit(self._attempt, channel, phone, message, 0, future)
+        except Exception:
+            self.pending.release()
+            raise
+        return future
+
+    def send_all(self, messages):
+        """Send (channel, phone, message) tuples in parallel and wait. Returns a list of bools."""
+        futures = [self.submit(*m) for m in messages]
+        return [f.exception() is None for f in futures]
+
+    def shutdown(self, wait=True):
+        # Pending retries are sent straight away so no message is left behind
+        with self.retry_ready:
+            self.closed = True
+            self.retry_ready.notify()
+        if wait:
+            self.retry_thread.join()
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
+
+
+# Example usage:
+if __name__ == "__main__":
+    server = FakeTwilioServer(latency=0.05, failure_rate=0.2, seed=1).start()
+    dispatcher = Dispatcher(HttpTransport(server.url), backoff=0.01)
+    messages = [("SMS", f"+2547000{i:05d}", "Time to take your medication.") for i in range(200)]
+    started = time.monotonic()
+    results = dispatcher.send_all(messages)
+    print(f"Sent {sum(results)}/{len(messages)} in {time.monotonic() - started:.2f}s, server received {len(server.received)}")
+    dispatcher.shutdown()
+    server.stop()
@@ -0,0 +1,152 @@
+# dose_index.py
+import threading
+from datetime import datetime, timezone
+
+from due_queue import patient_timezone
+from mock_db import get_patient, sync_feedback
+from storage import minute_of_day, schedule_minutes
+
+ANY_SLOT = "*"  # feedback that doesn't name a dose time counts for all of the day's doses
+
+_timezones = {}  # contact -> ZoneInfo
+
+
+def format_slot(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def contact_timezone(contact):
+    """Time zone of a patient's country (see due_queue.patient_timezone), looked up once per contact."""
+    if contact not in _timezones:
+        _timezones[contact] = patient_timezone(get_patient(contact))
+    return _timezones[contact]
+
+
+def local_time(tz, now=None):
+    """'now' (default: the current time) on the clock of tz. Naive datetimes are server-local, like feedback timestamps."""
+    return (now or datetime.now(timezone.utc)).astimezone(tz)
+
+
+def current_slot(schedule, now=None, tz=None):
+    """
+    Dose time ('HH:MM') a response given at 'now' refers to: the latest slot of the
+    schedule at or before now on the patient's local clock, or the first slot of
+    the day if none has passed yet.
+    """
+    minutes = schedule_minutes(schedule)
+    if not minutes:
+        return ANY_SLOT
+    now = local_time(tz or contact_timezone(schedule["patient_contact"]), now)
+    current = now.hour * 60 + now.minute
+    passed = [m for m in minutes if m <= current]
+    return format_slot(passed[-1] if passed else minutes[0])
+
+
+def _feedback_time(feedback):
+    ts = feedback.get("timestamp")
+    try:
+        return datetime.fromisoformat(ts) if isinstance(ts, str) else ts.astimezone()
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class DoseStatusIndex:
+    """
+    Today's response for every (contact, medication, dose slot), updated on each
+    feedback event. Lookups are O(1) instead of scanning the feedback log. "Today"
+    is the patient's local day (the time zone their doses are scheduled in), so
+    each patient's doses reset at their own midnight. sync() applies the feedback
+    stored since the last call, whichever process wrote it.
+    """
+
+    def __init__(self):
+        self.status = {}  # (contact, medication, slot) -> (patient's local date, latest response that day)
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.last_id = 0  # storage id of the last feedback record applied
+
+    def observe(self, feedback):
+        ts = _feedback_time(feedback)
+        if ts is None:
+            return
+        contact = feedback["patient_contact"]
+        day = local_time(contact_timezone(contact), ts).date()
+        slot = feedback.get("slot") or ANY_SLOT
+        minute = minute_of_day(slot)
+        if minute is not None:
+            slot = format_slot(minute)  # '8:00' and '08:00' are the same slot
+        key = (contact, feedback.get("medication"), slot)
+        with self.lock:
+            previous = self.status.get(key)
+            if previous is None or previous[0] <= day:
+                self.status[key] = (day, feedback.get("response"))
+
+    def apply(self, rows):
+        """Apply (id, feedback) rows from mock_db.iter_records, skipping ones already applied. Returns how many were."""
+        with self.sync_lock:
+            rows = [row for row in rows if row[0] > self.last_id]
+            for _, feedback in rows:
+                self.observe(feedback)
+            if rows:
+                self.last_id = rows[-1][0]
+        return len(rows)
+
+    def sync(self):
+        """Apply feedback stored since the last sync. Returns the number of records read."""
+        return sync_feedback(self)
+
+    def response(self, contact, medication, slot=ANY_SLOT, now=None):
+        """Today's (in the patient's time zone) response for a dose, or None if none has been logged."""
+        today = local_time(contact_timezone(contact), now).date()
+        with self.lock:
+            for key in ((contact, medication, slot), (contact, medication, ANY_SLOT)):
+                entry = self.status.get(key)
+                if entry is not None and entry[0] == today and entry[1] is not None:
+                    return entry[1]
+        return None
+
+    def logged(self, contact, medication, slot=ANY_SLOT, now=None):
+        return self.response(contact, medication, slot, now) is not None
+
+    def missed_doses(self, schedules, now=None, grace_minutes=60):
+        """
+        Doses from 'schedules' due at least grace_minutes ago today (on each patient's
+        local clock) that were answered 'no' or not answered at all. Returns a list of
+        dicts, one per missed dose.
+        """
+        now = now or datetime.now(timezone.utc)
+        missed = []
+        for sched in schedules:
+            local_now = local_time(contact_timezone(sched["patient_contact"]), now)
+            if sched.get("start_date") and sched["start_date"] > local_now.date().isoformat():
+                continue
+            cutoff = local_now.hour * 60 + local_now.minute - grace_minutes
+            for minute in schedule_minutes(sched):
+                if minute > cutoff:
+                    break
+                slot = format_slot(minute)
+                response = self.response(sched["patient_contact"], sched["medication"], slot, now)
+                if response in (None, "no"):
+                    missed.append({
+                        "patient_contact": sched["patient_contact"],
+                        "medication": sched["medication"],
+                        "slot": slot,
+                        "response": response or "no response",
+                    })
+        return missed
+
+
+# Shared index; readers call index.sync() (or mock_db.sync_feedback) to pick up feedback
+index = DoseStatusIndex()
+
+
+# Example usage:
+if __name__ == "__main__":
+    from mock_db import add_feedback, add_schedule, get_patients
+    contact = get_patients()[0]["contact"]
+    sched = add_schedule({"patient_contact": contact, "medication": "Metformin", "schedule": "00:00, 23:59"})
+    add_feedback({"patient_contact": contact, "medication": "Metformin", "timestamp": datetime.now().isoformat(),
+                  "response": "yes", "slot": current_slot(sched)})
+    index.sync()
+    print("Logged this dose:", index.logged(contact, "Metformin", current_slot(sched)))
+    print("Missed today:", index.missed_doses([sched], grace_minutes=0))
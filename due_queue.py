@@ -0,0 +1,99 @@
+# due_queue.py
+import heapq
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from storage import schedule_minutes
+
+# Schedule times are local to the patient's country
+COUNTRY_TIMEZONES = {
+    "Kenya": "Africa/Nairobi",
+    "Uganda": "Africa/Kampala",
+    "Tanzania": "Africa/Dar_es_Salaam",
+    "Rwanda": "Africa/Kigali",
+}
+DEFAULT_TIMEZONE = "Africa/Nairobi"
+
+
+def patient_timezone(patient):
+    return ZoneInfo(COUNTRY_TIMEZONES.get((patient or {}).get("country"), DEFAULT_TIMEZONE))
+
+
+def next_fire_time(minute, tz, after):
+    """First time strictly after 'after' (aware) when the local clock in tz reads minute-of-day."""
+    local = after.astimezone(tz)
+    candidate = local.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+    if candidate <= local:
+        candidate += timedelta(days=1)
+    return candidate.astimezone(timezone.utc)
+
+
+class DueQueue:
+    """
+    Min-heap of the next fire time of every (schedule, dose time). pop_due(now)
+    returns everything due since the last watermark, so a late or missed run
+    catches up instead of skipping reminders, and next_due() says how long the
+    scheduler can sleep. Doses more than max_catch_up overdue are skipped rather
+    than sent hours late.
+    """
+
+    def __init__(self, watermark=None, max_catch_up=timedelta(hours=1)):
+        self.heap = []  # (fire_at_utc, seq, schedule, minute, tz)
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.watermark = watermark or datetime.now(timezone.utc)
+        self.max_catch_up = max_catch_up
+
+    def add_schedule(self, schedule, patient=None):
+        tz = patient_timezone(patient)
+        with self.lock:
+            for minute in schedule_minutes(schedule):
+                fire_at = next_fire_time(minute, tz, self.watermark)
+                heapq.heappush(self.heap, (fire_at, next(self.seq), schedule, minute, tz))
+
+    def pop_due(self, now):
+        """
+        Pop every dose with a fire time <= now and queue its next occurrence.
+        Returns a list of (fire_at_utc, schedule, minute, tz), oldest first.
+        """
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                fire_at, _, schedule, minute, tz = heapq.heappop(self.heap)
+                if now - fire_at <= self.max_catch_up:
+                    due.append((fire_at, schedule, minute, tz))
+                heapq.heappush(self.heap, (next_fire_time(minute, tz, fire_at), next(self.seq), schedule, minute, tz))
+            self.watermark = max(self.watermark, now)
+        return due
+
+    def next_due(self):
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+
+def load_watermark(path, max_catch_up=timedelta(hours=1)):
+    """
+    Last processed time saved by save_watermark, limited to max_catch_up ago so a
+    long outage doesn't replay stale reminders. Defaults to now.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        with open(path) as f:
+            watermark = datetime.fromisoformat(json.load(f)["watermark"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return now
+    return min(now, max(watermark, now - max_catch_up))
+
+
+def save_watermark(path, watermark):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"watermark": watermark.isoformat()}, f)
+    os.replace(tmp_path, path)
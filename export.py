@@ -0,0 +1,186 @@
+# export.py
+import argparse
+import json
+import os
+import re
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from mock_db import get_feedback, get_patient, iter_records
+from ml_model import build_feature_matrix, predict_adherence_risk_batch, predict_dropout_risk_batch
+
+DATASETS = ["feedback", "schedules", "risk_scores"]
+FORMATS = ["parquet", "csv"]
+PARTITIONS = ["date", "country"]
+WATERMARK_FILE = "_watermark.json"
+
+
+def load_watermarks(out_dir):
+    """Last exported record id per dataset, e.g. {"feedback": 1200, "schedules": 40}."""
+    try:
+        with open(os.path.join(out_dir, WATERMARK_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_watermarks(out_dir, watermarks):
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, f"{WATERMARK_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, WATERMARK_FILE))
+
+
+class CountryLookup:
+    """Patient contact -> country, fetched once per contact."""
+
+    def __init__(self):
+        self.countries = {}
+
+    def __call__(self, contact):
+        if contact not in self.countries:
+            patient = get_patient(contact)
+            self.countries[contact] = (patient or {}).get("country") or "unknown"
+        return self.countries[contact]
+
+
+def _partition_value(value):
+    value = "unknown" if value is None or value == "" or value != value else str(value)
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+
+def _to_frame(rows):
+    """(id, record) pairs -> DataFrame with an 'id' column; nested values become JSON strings."""
+    df = pd.DataFrame([record for _, record in rows])
+    df.insert(0, "id", [row_id for row_id, _ in rows])
+    for column in df.columns[df.dtypes == object]:
+        if df[column].map(lambda v: isinstance(v, (dict, list))).any():
+            df[column] = df[column].map(lambda v: json.dumps(v, default=str) if isinstance(v, (dict, list)) else v)
+    return df
+
+
+def write_partitions(df, out_dir, dataset, part_name, fmt="parquet"):
+    """
+    Write df under out_dir/dataset/date=.../country=.../part_name.<ext> (Hive-style
+    partitions, readable with pandas.read_parquet(out_dir/dataset)). Files are
+    written to a temp name and renamed, and part names are derived from record
+    ids, so re-running an interrupted export overwrites rather than duplicates.
+    Returns the number of files written.
+    """
+    files = 0
+    for keys, group in df.groupby(PARTITIONS, dropna=False, sort=False):
+        directory = os.path.join(out_dir, dataset, *(f"{col}={_partition_value(key)}" for col, key in zip(PARTITIONS, keys)))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{part_name}.{fmt}")
+        tmp_path = f"{path}.tmp"
+        data = group.drop(columns=PARTITIONS)
+        if fmt == "parquet":
+            data.to_parquet(tmp_path, engine="pyarrow", index=False)
+        else:
+            data.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        files += 1
+    return files
+
+
+def export_records(kind, dataset, out_dir, fmt, chunk_size, watermarks, partition_fn, progress=None):
+    """Stream one kind of record past its watermark, chunk by chunk, advancing the watermark after each."""
+    rows_written = 0
+    for rows in iter_records(kind, watermarks.get(dataset, 0), chunk_size):
+        df = _to_frame(rows)
+        df["date"], df["country"] = partition_fn(df)
+        write_partitions(df, out_dir, dataset, f"part-{rows[0][0]:012d}-{rows[-1][0]:012d}", fmt)
+        rows_written += len(rows)
+        watermarks[dataset] = rows[-1][0]
+        save_watermarks(out_dir, watermarks)
+        if progress:
+            progress(dataset, rows_written)
+    return rows_written
+
+
+def export_risk_scores(out_dir, fmt, chunk_size, snapshot=None, progress=None):
+    """
+    Score every patient with the adherence and dropout models and write the
+    snapshot under date=<snapshot>, one model call per chunk of patients.
+    A snapshot is a full export, so re-running it on the same day replaces it.
+    """
+    snapshot = snapshot or date.today()
+    since = (datetime.combine(snapshot, datetime.min.time()) - timedelta(days=7)).isoformat()
+    recent_counts = Counter(f["patient_contact"] for f in get_feedback(since=since))
+    rows_written = 0
+    for rows in iter_records("patient", 0, chunk_size):
+        patients = [patient for _, patient in rows]
+        X = build_feature_matrix(patients, feedback_counts=recent_counts)
+        risk_probs, risk_labels, _ = predict_adherence_risk_batch(X)
+        X_dropout = np.column_stack([X[:, 0], [p.get("negative_feedback_count", 0) for p in patients]])
+        dropout_probs, dropout_labels = predict_dropout_risk_batch(X_dropout)
+        df = pd.DataFrame({
+            "id": [row_id for row_id, _ in rows],
+            "contact": [p["contact"] for p in patients],
+            "name": [p.get("name") for p in patients],
+            "adherence_risk": risk_probs,
+            "adherence_high_risk": risk_labels,
+            "dropout_risk": dropout_probs,
+            "dropout_high_risk": dropout_labels,
+            "date": snapshot.isoformat(),
+            "country": [p.get("country") for p in patients],
+        })
+        write_partitions(df, out_dir, "risk_scores", f"part-{rows[0][0]:012d}-{rows[-1][0]:012d}", fmt)
+        rows_written += len(rows)
+        if progress:
+            progress("risk_scores", rows_written)
+    return rows_written
+
+
+def export_all(out_dir, fmt="parquet", datasets=DATASETS, chunk_size=50000, full=False, progress=None):
+    """
+    Export the given datasets to out_dir. Feedback and schedules are incremental:
+    only records added since the last export (the watermark in out_dir) are
+    written, unless full=True. Returns {dataset: rows written}.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow); or use --format csv.")
+    watermarks = {} if full else load_watermarks(out_dir)
+    country = CountryLookup()
+    counts = {}
+    if "feedback" in datasets:
+        counts["feedback"] = export_records(
+            "feedback", "feedback", out_dir, fmt, chunk_size, watermarks,
+            lambda df: (df["timestamp"].astype(str).str[:10], df["patient_contact"].map(country)), progress)
+    if "schedules" in datasets:
+        counts["schedules"] = export_records(
+            "schedule", "schedules", out_dir, fmt, chunk_size, watermarks,
+            lambda df: (df.get("start_date", pd.Series(None, index=df.index)), df["patient_contact"].map(country)),
+            progress)
+    if "risk_scores" in datasets:
+        counts["risk_scores"] = export_risk_scores(out_dir, fmt, chunk_size, progress=progress)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export feedback, schedules and risk scores to Parquet or CSV.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", default="parquet", choices=FORMATS)
+    parser.add_argument("--datasets", nargs="+", default=DATASETS, choices=DATASETS)
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export everything")
+    args = parser.parse_args()
+    if os.getenv("TIBA_STORAGE", "memory") == "memory":
+        print("[EXPORT] Warning: TIBA_STORAGE is 'memory', so only the built-in example data is exported. Use TIBA_STORAGE=sqlite.")
+    counts = export_all(args.out_dir, args.format, args.datasets, args.chunk_size, args.full,
+                        progress=lambda dataset, n: print(f"[EXPORT] {dataset}: {n} rows"))
+    for dataset, n in counts.items():
+        print(f"[EXPORT] {dataset}: {n} new rows written to {os.path.join(args.out_dir, dataset)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+import re
+
 from textblob import TextBlob
 
+from result_cache import ResultCache, content_key, parallel_map
+
 # Example intent keywords
 INTENT_KEYWORDS = {
     "side_effects": ["nausea", "vomit", "dizzy", "rash", "pain", "side effect"],
@@ -8,24 +12,34 @@ INTENT_KEYWORDS = {
     "cost": ["expensive", "cost", "money", "afford"],
     "other": []
 }
+FLAG_INTENTS = ("side_effects", "cost", "confused")
 
-def analyze_feedback(feedback_text):
+# Every keyword in one pattern; the lookahead reports overlapping matches, so this
+# finds exactly the keywords a substring check per keyword would
+KEYWORD_INTENTS = {kw: intent for intent, keywords in INTENT_KEYWORDS.items() for kw in keywords}
+INTENT_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(kw) for kw in sorted(KEYWORD_INTENTS, key=len, reverse=True)) + "))"
+)
+
+ANALYSIS_CACHE_SIZE = 50000  # max cached analyses (LRU)
+_analysis_cache = ResultCache(ANALYSIS_CACHE_SIZE)  # text hash -> analysis (copied in and out)
+
+def detect_intents(text_lower):
+    found = {KEYWORD_INTENTS[m.group(1)] for m in INTENT_PATTERN.finditer(text_lower)}
+    # Keep INTENT_KEYWORDS order
+    return [intent for intent in INTENT_KEYWORDS if intent in found] or ["other"]
+
+def _analyze(feedback_text):
     # Sentiment analysis
     blob = TextBlob(feedback_text)
     polarity = blob.sentiment.polarity  # -1 (negative) to 1 (positive)
     sentiment = "positive" if polarity > 0.1 else "negative" if polarity < -0.1 else "neutral"
     
     # Intent detection
-    detected_intents = []
-    text_lower = feedback_text.lower()
-    for intent, keywords in INTENT_KEYWORDS.items():
-        if any(kw in text_lower for kw in keywords):
-            detected_intents.append(intent)
-    if not detected_intents:
-        detected_intents.append("other")
+    detected_intents = detect_intents(feedback_text.lower())
     
     # Flag if negative or concerning intent
-    flag = sentiment == "negative" or any(i in detected_intents for i in ["side_effects", "cost", "confused"])
+    flag = sentiment == "negative" or any(i in detected_intents for i in FLAG_INTENTS)
     
     return {
         "sentiment": sentiment,
@@ -34,8 +48,39 @@ def analyze_feedback(feedback_text):
         "flag": flag
     }
 
+def _text_key(feedback_text):
+    return content_key(feedback_text.encode("utf-8"))
+
+def analyze_feedback(feedback_text):
+    """Sentiment, intents and review flag for one message (cached by text hash)."""
+    return analyze_feedback_batch([feedback_text], workers=1)[0]
+
+def analyze_feedback_batch(feedback_texts, workers=None, min_parallel=500):
+    """
+    Analyze many messages. Results are cached by a hash of each text, so repeated
+    replies ("yes", "forgot") are analyzed once; the remaining unique texts are
+    fanned out across a process pool when there are at least min_parallel of them.
+    Returns: list of analysis dicts, one per text
+    """
+    texts = [text or "" for text in feedback_texts]
+    keys = [_text_key(text) for text in texts]
+    results = _analysis_cache.get_many(keys)
+    misses = {}  # key -> text, unique texts not in the cache
+    for i, key in enumerate(keys):
+        if results[i] is None:
+            misses.setdefault(key, texts[i])
+    if misses:
+        analyses = parallel_map(_analyze, list(misses.values()), workers=workers, min_parallel=min_parallel)
+        computed = dict(zip(misses, analyses))
+        _analysis_cache.put_many(computed.items())
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = _analysis_cache.copy_value(computed[key])  # repeated texts get their own copies
+    return results
+
 # Example usage
 if __name__ == "__main__":
     feedback = "I felt dizzy and nauseous after taking the medicine."
     result = analyze_feedback(feedback)
-    print(result) 
\ No newline at end of file
+    print(result)
+    print(analyze_feedback_batch(["I forgot", "It is too expensive", "I forgot"]))
@@ -0,0 +1,181 @@
+# feedback_store.py
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from mock_db import sync_feedback
+
+RESPONSES = ["yes", "no", "delay", "unknown"]
+RESPONSE_CODES = {r: i for i, r in enumerate(RESPONSES)}
+NONADHERENT_CODES = [RESPONSE_CODES["no"], RESPONSE_CODES["delay"]]
+COLUMNS = {"timestamp": np.int64, "response": np.int8, "contact": np.int32, "medication": np.int32}
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_us(ts):
+    """ISO string or datetime -> int64 microseconds since the epoch (naive local time)."""
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)  # to server local time, like naive feedback timestamps
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+class ColumnarFeedbackStore:
+    """
+    Compact feedback history: int64 epoch-microsecond timestamps, int8 response
+    codes and dictionary-encoded contact/medication IDs in NumPy arrays (~17 bytes
+    per event). New events go into an in-memory active segment; once it holds
+    segment_size events it is written to 'directory' and reopened memory-mapped,
+    so old history is scanned from the page cache without copying into the heap.
+    sync() appends the feedback stored since the last call, whichever process
+    wrote it.
+    """
+
+    def __init__(self, directory=None, segment_size=1_000_000):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.contacts, self.contact_ids = [], {}
+        self.medications, self.medication_ids = [], {}
+        self.segments = []  # sealed, memory-mapped column dicts
+        self.last_id = 0  # storage id of the last feedback record appended
+        self.sealed_id = 0  # ... and of the last one in a sealed segment
+        self.lock = threading.RLock()
+        self._reset_active()
+        if directory and os.path.isdir(directory):
+            self._load()
+
+    def _reset_active(self):
+        self.active = {name: np.empty(1024, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.active_size = 0
+
+    def _encode(self, value, values, ids):
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def append(self, feedback):
+        """Add one feedback record. Returns False (and skips it) if its timestamp can't be read."""
+        try:
+            ts = to_epoch_us(feedback["timestamp"])
+        except (KeyError, TypeError, ValueError, AttributeError):
+            print(f"[FEEDBACK STORE ERROR] Skipping feedback with bad timestamp: {feedback.get('timestamp')!r}")
+            return False
+        with self.lock:
+            if self.active_size == len(self.active["timestamp"]):
+                for name in COLUMNS:
+                    self.active[name] = np.resize(self.active[name], 2 * self.active_size)
+            i = self.active_size
+            self.active["timestamp"][i] = ts
+            self.active["response"][i] = RESPONSE_CODES.get(feedback.get("response"), RESPONSE_CODES["unknown"])
+            self.active["contact"][i] = self._encode(feedback["patient_contact"], self.contacts, self.contact_ids)
+            self.active["medication"][i] = self._encode(feedback.get("medication"), self.medications, self.medication_ids)
+            self.active_size += 1
+        return True
+
+    def apply(self, rows):
+        """Append (id, feedback) rows from mock_db.iter_records, skipping ones already appended. Returns how many were."""
+        applied = 0
+        with self.lock:
+            for row_id, feedback in rows:
+                if row_id <= self.last_id:
+                    continue
+                self.append(feedback)
+                self.last_id = row_id
+                applied += 1
+                if self.directory and self.active_size >= self.segment_size:
+                    self.seal()
+        return applied
+
+    def sync(self):
+        """Append feedback stored since the last sync. Returns the number of records read."""
+        return sync_feedback(self)
+
+    def seal(self):
+        """Write the active segment to disk and reopen it memory-mapped."""
+        with self.lock:
+            if not self.directory or self.active_size == 0:
+                return
+            path = os.path.join(self.directory, f"segment_{len(self.segments):06d}")
+            os.makedirs(path, exist_ok=True)
+            for name in COLUMNS:
+                np.save(os.path.join(path, f"{name}.npy"), self.active[name][:self.active_size])
+            self.sealed_id = self.last_id
+            self._save_dictionaries()
+            self.segments.append(self._open_segment(path))
+            self._reset_active()
+
+    def _save_dictionaries(self):
+        tmp_path = os.path.join(self.directory, "dictionaries.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"contacts": self.contacts, "medications": self.medications, "last_id": self.sealed_id}, f)
+        os.replace(tmp_path, os.path.join(self.directory, "dictionaries.json"))
+
+    def _open_segment(self, path):
+        return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, "dictionaries.json")) as f:
+                dictionaries = json.load(f)
+        except FileNotFoundError:
+            return
+        for contact in dictionaries["contacts"]:
+            self._encode(contact, self.contacts, self.contact_ids)
+        for medication in dictionaries["medications"]:
+            self._encode(medication, self.medications, self.medication_ids)
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("segment_"):
+                self.segments.append(self._open_segment(os.path.join(self.directory, name)))
+        # Older directories have no id; their segments hold the first len(self) records
+        self.last_id = self.sealed_id = dictionaries.get("last_id", len(self))
+
+    def iter_segments(self):
+        """Column dicts for every segment, oldest first (the active one as a view)."""
+        with self.lock:
+            active = {name: column[:self.active_size] for name, column in self.active.items()}
+            return self.segments + [active]
+
+    def __len__(self):
+        return sum(len(segment["timestamp"]) for segment in self.iter_segments())
+
+    def contact_events(self, patient_contact):
+        """(timestamps, response codes) for one patient, in arrival order."""
+        contact_id = self.contact_ids.get(patient_contact)
+        if contact_id is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8)
+        parts = [(s["timestamp"][s["contact"] == contact_id], s["response"][s["contact"] == contact_id])
+                 for s in self.iter_segments()]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def risk_trend(self, patient_contact, window=5):
+        """Like ml_model.risk_trend, computed from the stored integer columns."""
+        ts, responses = self.contact_events(patient_contact)
+        if len(ts) == 0:
+            return []
+        order = np.argsort(ts, kind="stable")
+        nonadherent = np.isin(responses[order], NONADHERENT_CODES).astype(float)
+        csum = np.concatenate([[0.0], np.cumsum(nonadherent)])
+        idx = np.arange(1, len(nonadherent) + 1)
+        start = np.maximum(idx - window, 0)
+        risk = (csum[idx] - csum[start]) / (idx - start)
+        labels = pd.to_datetime(ts[order], unit="us").astype(str)
+        return list(zip(labels, risk))
+
+    def counts_since(self, since):
+        """Feedback count per patient contact with a timestamp after 'since' (datetime)."""
+        cutoff = to_epoch_us(since)
+        counts = np.zeros(len(self.contacts), dtype=np.int64)
+        for segment in self.iter_segments():
+            recent = segment["contact"][segment["timestamp"] > cutoff]
+            counts[:len(self.contacts)] += np.bincount(recent, minlength=len(self.contacts))[:len(self.contacts)]
+        return {contact: int(n) for contact, n in zip(self.contacts, counts) if n}
+
+
+# Shared store; readers call store.sync() (or mock_db.sync_feedback) to pick up feedback
+store = ColumnarFeedbackStore(os.getenv("TIBA_FEEDBACK_SEGMENTS"))
@@ -1,7 +1,15 @@
+from itertools import repeat
+
 import numpy as np
 import pandas as pd
 from statsmodels.tsa.arima.model import ARIMA
 
+from result_cache import ResultCache, content_key, parallel_map
+
+FORECAST_CACHE_SIZE = 10000  # max cached forecasts (LRU)
+# history hash -> forecast; forecasts are stored read-only, so they are shared without copying
+_forecast_cache = ResultCache(FORECAST_CACHE_SIZE, copy_value=None)
+
 def forecast_adherence_arima(adherence_history, steps=7):
     """
     Forecast future adherence using ARIMA.
@@ -17,8 +25,70 @@ def forecast_adherence_arima(adherence_history, steps=7):
     # Clip to [0, 1] for probability interpretation
     return np.clip(forecast, 0, 1)
 
+def forecast_ar1_batch(adherence_histories, steps=7):
+    """
+    Closed-form AR(1) forecast for many patients at once with NumPy.
+    Fits x_t - mu = phi * (x_{t-1} - mu) by least squares for every history
+    (histories may have different lengths) and returns an (N, steps) array.
+    """
+    n = len(adherence_histories)
+    lengths = np.array([len(h) for h in adherence_histories], dtype=int)
+    if n == 0 or not lengths.all():
+        # An empty history has no mean to forecast from: its forecast is all zeros
+        forecast = np.zeros((n, steps))
+        if lengths.any():
+            nonempty = lengths > 0
+            forecast[nonempty] = forecast_ar1_batch([h for h in adherence_histories if len(h)], steps)
+        return forecast
+    X = np.full((n, max(lengths.max(), 1)), np.nan)
+    for i, h in enumerate(adherence_histories):
+        X[i, :len(h)] = h
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu = np.nanmean(X, axis=1)
+        dev = X - mu[:, None]
+        prev, nxt = dev[:, :-1], dev[:, 1:]
+        num = np.nansum(prev * nxt, axis=1)
+        den = np.nansum(np.where(np.isnan(nxt), np.nan, prev) ** 2, axis=1)
+        phi = np.where(den > 0, num / den, 0.0)
+    phi = np.clip(phi, -0.99, 0.99)  # keep the process stationary
+    mu = np.nan_to_num(mu)
+    last = np.nan_to_num(dev[np.arange(n), np.maximum(lengths - 1, 0)])
+    horizons = np.arange(1, steps + 1)
+    forecast = mu[:, None] + phi[:, None] ** horizons * last[:, None]
+    return np.clip(forecast, 0, 1)
+
+def _history_key(adherence_history, steps, method):
+    return content_key(np.asarray(adherence_history, dtype=float).tobytes(), steps, method)
+
+def forecast_many(adherence_histories, steps=7, method="arima", workers=None, min_parallel=8):
+    """
+    Forecast adherence for many patients.
+    method: "arima" fits statsmodels ARIMA(1,0,0) per patient, fanned out across a
+            process pool; "ar1" uses the closed-form forecast_ar1_batch.
+    Forecasts are cached by a hash of each history, so unchanged patients are never refit.
+    Returns: list of read-only forecast arrays, one per history
+    """
+    keys = [_history_key(h, steps, method) for h in adherence_histories]
+    results = _forecast_cache.get_many(keys)
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        histories = [adherence_histories[i] for i in misses]
+        if method == "ar1":
+            forecasts = list(forecast_ar1_batch(histories, steps))
+        elif method == "arima":
+            forecasts = parallel_map(forecast_adherence_arima, histories, repeat(steps),
+                                     workers=workers, min_parallel=min_parallel)
+        else:
+            raise ValueError(f"Unknown forecast method: {method}")
+        for i, forecast in zip(misses, forecasts):
+            results[i] = np.array(forecast, dtype=float)
+            results[i].flags.writeable = False
+        _forecast_cache.put_many((keys[i], results[i]) for i in misses)
+    return results
+
 # Example usage:
 if __name__ == "__main__":
     history = [1, 1, 0, 1, 1, 0, 1, 1, 1, 0, 1, 1, 1, 0]
     forecast = forecast_adherence_arima(history, steps=7)
-    print("Next 7 days adherence forecast:", forecast) 
\ No newline at end of file
+    print("Next 7 days adherence forecast:", forecast)
+    print("Closed-form AR(1) forecast:", forecast_ar1_batch([history], steps=7)[0])
@@ -0,0 +1,108 @@
+# ingest.py
+import atexit
+import queue
+import threading
+
+from mock_db import add_feedback_many
+
+
+class FeedbackIngestor:
+    """
+    Bounded queue of inbound feedback records that a background thread writes to
+    storage in batches, so the webhook can reply without waiting on the database.
+    When the queue is full, submit() writes the records itself (back-pressure)
+    rather than dropping them, and a failed batch write is retried with backoff.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=500, flush_interval=0.5, writer=add_feedback_many,
+                 retry_delay=0.5, max_retry_delay=30.0, max_retries=5):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_retries = max_retries
+        self.writer = writer
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="feedback-ingestor", daemon=True)
+        self.thread.start()
+
+    def submit(self, records):
+        overflow = []
+        for record in records:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                overflow.append(record)
+        if overflow:
+            self.writer(overflow)
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self.stopped.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        """
+        Write a batch, retrying with exponential backoff until it succeeds: the
+        patients have already been thanked, so a failed batch is never dropped.
+        Once stopping, gives up after max_retries and writes the records one at a
+        time, printing any that still cannot be stored.
+        """
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            try:
+                self.writer(batch)
+                return
+            except Exception as e:
+                attempt += 1
+                print(f"[INGEST ERROR] Failed to write {len(batch)} feedback records (attempt {attempt}): {e}")
+            if self.stopped.is_set() and attempt >= self.max_retries:
+                break
+            self.stopped.wait(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+        for record in batch:
+            try:
+                self.writer([record])
+            except Exception as e:
+                print(f"[INGEST ERROR] Could not store feedback {record}: {e}")
+
+    def flush(self):
+        """Block until everything submitted so far has been written."""
+        self.queue.join()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+_ingestor = None
+_ingestor_lock = threading.Lock()
+
+
+def get_ingestor():
+    global _ingestor
+    with _ingestor_lock:
+        if _ingestor is None:
+            _ingestor = FeedbackIngestor()
+            atexit.register(_ingestor.stop)
+        return _ingestor
@@ -11,41 +11,48 @@ client = None
 if TWILIO_SID and TWILIO_TOKEN:
     client = Client(TWILIO_SID, TWILIO_TOKEN)
 
-def send_sms(phone, message):
-    if client and TWILIO_PHONE:
-        try:
-            client.messages.create(
-                body=message,
-                from_=TWILIO_PHONE,
-                to=phone
-            )
-        except Exception as e:
-            print(f"[TWILIO SMS ERROR] {e}")
+def deliver(channel, phone, message):
+    """
+    Send one message on a channel ('SMS', 'WhatsApp' or 'Voice').
+    Unlike send_sms/send_whatsapp/send_voice, Twilio errors are raised so callers can retry.
+    """
+    if channel == "SMS" and client and TWILIO_PHONE:
+        client.messages.create(
+            body=message,
+            from_=TWILIO_PHONE,
+            to=phone
+        )
+    elif channel == "WhatsApp" and client and TWILIO_WHATSAPP:
+        client.messages.create(
+            body=message,
+            from_='whatsapp:' + TWILIO_WHATSAPP,
+            to='whatsapp:' + phone
+        )
+    elif channel == "Voice" and client and TWILIO_PHONE:
+        client.calls.create(
+            twiml=f'<Response><Say>{message}</Say></Response>',
+            from_=TWILIO_PHONE,
+            to=phone
+        )
+    elif channel in ("SMS", "WhatsApp", "Voice"):
+        print(f"[MOCK {channel}] To: {phone} | Message: {message}")
     else:
-        print(f"[MOCK SMS] To: {phone} | Message: {message}")
+        raise ValueError(f"Unknown channel: {channel}")
+
+def send_sms(phone, message):
+    try:
+        deliver("SMS", phone, message)
+    except Exception as e:
+        print(f"[TWILIO SMS ERROR] {e}")
 
 def send_whatsapp(phone, message):
-    if client and TWILIO_WHATSAPP:
-        try:
-            client.messages.create(
-                body=message,
-                from_='whatsapp:' + TWILIO_WHATSAPP,
-                to='whatsapp:' + phone
-            )
-        except Exception as e:
-            print(f"[TWILIO WhatsApp ERROR] {e}")
-    else:
-        print(f"[MOCK WhatsApp] To: {phone} | Message: {message}")
+    try:
+        deliver("WhatsApp", phone, message)
+    except Exception as e:
+        print(f"[TWILIO WhatsApp ERROR] {e}")
 
 def send_voice(phone, message):
-    if client and TWILIO_PHONE:
-        try:
-            client.calls.create(
-                twiml=f'<Response><Say>{message}</Say></Response>',
-                from_=TWILIO_PHONE,
-                to=phone
-            )
-        except Exception as e:
-            print(f"[TWILIO Voice ERROR] {e}")
-    else:
-        print(f"[MOCK Voice] To: {phone} | Message: {message}") 
\ No newline at end of file
+    try:
+        deliver("Voice", phone, message)
+    except Exception as e:
+        print(f"[TWILIO Voice ERROR] {e}")
@@ -0,0 +1,254 @@
+# metrics.py
+import cProfile
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers sub-millisecond cache lookups up to slow ARIMA fits and ticks
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+# Port for processes without a web app to serve /metrics on (0 disables)
+METRICS_PORT = int(os.getenv("TIBA_METRICS_PORT", "9464"))
+
+# Directory for cProfile dumps of profiled sections; profiling is off when unset
+PROFILE_DIR = os.getenv("TIBA_PROFILE_DIR")
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value, quote=True):
+    # Exposition format escapes: backslash, newline, and (in label values) double quote
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in key) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set, e.g. messages_sent.inc(channel="SMS")."""
+
+    kind = "counter"
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> count
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """Bucketed observations (cumulative, as Prometheus expects) plus count and sum per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values = {}  # label key -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += 1
+            state[-1] += value
+
+    def time(self, **labels):
+        return Timer(self, **labels)
+
+    def count(self, **labels):
+        state = self.values.get(_label_key(labels))
+        return state[-2] if state else 0
+
+    def sum(self, **labels):
+        state = self.values.get(_label_key(labels))
+        return state[-1] if state else 0.0
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, state in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, state):
+                    cumulative += n
+                    result.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), cumulative))
+                result.append((f"{self.name}_count", key, state[-2]))
+                result.append((f"{self.name}_sum", key, state[-1]))
+        return result
+
+
+class Timer:
+    """Context manager / decorator recording elapsed seconds into a histogram."""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Timer(self.histogram, **self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class Registry:
+    """Named metrics for this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, **kwargs)
+            metric = self.metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        for name, metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {name} {_escape(metric.help, quote=False)}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, key, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help=""):
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name, help="", buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, buckets)
+
+
+def render():
+    return REGISTRY.render()
+
+
+def serve(port=METRICS_PORT, host="0.0.0.0"):
+    """
+    Serve this process's metrics at http://host:port/metrics from a background
+    thread, for processes that have no web app of their own (the scheduler and
+    shard workers). Returns the server, or None if port is 0 or already in use.
+    """
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"[METRICS ERROR] Could not serve metrics on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+@contextmanager
+def profile(section, profile_dir=None):
+    """
+    Profile a section with cProfile when TIBA_PROFILE_DIR (or profile_dir) is set,
+    dumping <section>-<timestamp>.prof for `python -m pstats` or snakeviz.
+    Does nothing otherwise.
+    """
+    profile_dir = profile_dir or PROFILE_DIR
+    if not profile_dir:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{section}-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.prof"))
+
+
+# Example usage:
+if __name__ == "__main__":
+    sends = counter("example_messages_sent_total", "Messages sent")
+    latency = histogram("example_send_seconds", "Send latency")
+    for channel in ["SMS", "SMS", "WhatsApp"]:
+        with latency.time(channel=channel):
+            time.sleep(0.001)
+        sends.inc(channel=channel)
+    print(render())
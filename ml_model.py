@@ -1,10 +1,15 @@
 # ml_model.py
 import pandas as pd
 import numpy as np
+from datetime import datetime, timedelta
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 from sklearn.ensemble import RandomForestClassifier
+from model_registry import get_model
+from metrics import histogram
+
+inference_seconds = histogram("tiba_model_inference_seconds", "Time per batch model prediction")
 
 # Mock data for demonstration (replace with real data integration)
 # Features: [recent_adherence_rate, age, num_medications, feedback_count]
@@ -23,12 +28,25 @@ X = np.array([
 # Labels: 1 = high risk, 0 = low risk
 Y = np.array([0, 1, 1, 1, 0, 1, 0, 1, 1, 0])
 
-# Train/test split
-X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+def train_adherence_model():
+    """Fits the adherence risk model; run offline via `python model_registry.py train`."""
+    # Train/test split
+    X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+    # Train logistic regression model
+    model = LogisticRegression()
+    model.fit(X_train, y_train)
+    return model
+
+def get_adherence_model():
+    # The online model (online_learning.py) takes over once it has learned from enough live feedback
+    from online_learning import current_model
+    online = current_model()
+    if online is not None:
+        return online
+    # Otherwise the offline model, loaded lazily from the model registry on first use
+    return get_model("adherence", train_adherence_model)
 
-# Train logistic regression model
-model = LogisticRegression()
-model.fit(X_train, y_train)
+FEATURE_NAMES = ['recent_adherence_rate', 'age', 'num_medications', 'feedback_count']
 
 def predict_adherence_risk(features):
     """
@@ -40,17 +58,57 @@ def predict_adherence_risk(features):
         risk_label (int): 1 = high risk, 0 = low risk
         feature_importance (dict): Feature importance scores
     """
-    risk_prob = model.predict_proba([features])[0][1]
-    risk_label = int(risk_prob > 0.5)
+    probs, labels, importance = predict_adherence_risk_batch(np.array([features], dtype=float))
+    return probs[0], int(labels[0]), importance
+
+def predict_adherence_risk_batch(X):
+    """
+    Predicts the risk of non-adherence for many patients with a single model call.
+    Args:
+        X (np.ndarray): (N, 4) feature matrix, columns as in FEATURE_NAMES
+    Returns:
+        risk_probs (np.ndarray): (N,) probabilities of high risk
+        risk_labels (np.ndarray): (N,) 1 = high risk, 0 = low risk
+        feature_importance (dict): Feature importance scores (shared by all patients)
+    """
+    model = get_adherence_model()
+    with inference_seconds.time(model="adherence"):
+        risk_probs = model.predict_proba(X)[:, 1]
+    risk_labels = (risk_probs > 0.5).astype(int)
     # Feature importance (absolute value of coefficients)
-    feature_names = ['recent_adherence_rate', 'age', 'num_medications', 'feedback_count']
-    importance = dict(zip(feature_names, np.abs(model.coef_[0])))
-    return risk_prob, risk_label, importance
+    importance = dict(zip(FEATURE_NAMES, np.abs(model.coef_[0])))
+    return risk_probs, risk_labels, importance
+
+def build_feature_matrix(patients, feedback_log=None, now=None, days=7, feedback_counts=None):
+    """
+    Builds the (N, 4) feature matrix [recent_adherence_rate, age, num_medications,
+    feedback_count] for all patients. Feedback counts over the last 'days' days are
+    computed with one pass over the feedback log rather than one scan per patient,
+    or can be passed in precomputed as a dict of contact -> count.
+    """
+    now = now or datetime.now()
+    if feedback_counts is None:
+        feedback_counts = {}
+        if feedback_log:
+            df = pd.DataFrame(feedback_log, columns=["patient_contact", "timestamp"])
+            ts = pd.to_datetime(df["timestamp"], format="ISO8601", errors="coerce")
+            recent = df[ts > now - timedelta(days=days)]
+            feedback_counts = recent["patient_contact"].value_counts().to_dict()
+    X = np.zeros((len(patients), len(FEATURE_NAMES)))
+    for i, patient in enumerate(patients):
+        adherence_history = patient.get('adherence_history', [])
+        if adherence_history:
+            X[i, 0] = sum(adherence_history[-7:]) / min(len(adherence_history), 7)
+        X[i, 1] = patient.get('age', 40)
+        X[i, 2] = patient.get('num_medications', 2)
+        X[i, 3] = feedback_counts.get(patient['contact'], 0)
+    return X
 
 # Example usage:
 if __name__ == "__main__":
     print("Classification report on test set:")
-    y_pred = model.predict(X_test)
+    X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+    y_pred = get_adherence_model().predict(X_test)
     print(classification_report(y_test, y_pred))
     # Predict for a new patient
     features = [0.6, 50, 2, 7]
@@ -108,6 +166,7 @@ def detect_anomalies(patient_contact, feedback_log, window=5):
         prev_risk = risk
     return anomalies
 
+
 # Example: Dropout/complication risk prediction
 # Mock data for demonstration
 X_risk = [
@@ -123,13 +182,32 @@ X_risk = [
     [0.85, 0],
 ]
 Y_risk = [0, 1, 1, 1, 0, 1, 0, 1, 1, 0]  # 1 = high risk
-risk_model = RandomForestClassifier(random_state=42)
-risk_model.fit(X_risk, Y_risk)
+
+def train_dropout_model():
+    """Fits the dropout risk model; run offline via `python model_registry.py train`."""
+    risk_model = RandomForestClassifier(random_state=42)
+    risk_model.fit(X_risk, Y_risk)
+    return risk_model
+
+def get_dropout_model():
+    # Loaded lazily from the model registry on first use
+    return get_model("dropout", train_dropout_model)
 
 def predict_dropout_risk(recent_adherence_rate, negative_feedback_count):
-    prob = risk_model.predict_proba([[recent_adherence_rate, negative_feedback_count]])[0][1]
-    label = int(prob > 0.5)
-    return prob, label
+    probs, labels = predict_dropout_risk_batch(np.array([[recent_adherence_rate, negative_feedback_count]], dtype=float))
+    return probs[0], int(labels[0])
+
+def predict_dropout_risk_batch(X):
+    """
+    Dropout/complication risk for many patients with a single model call.
+    X: (N, 2) array of [recent_adherence_rate, negative_feedback_count]
+    Returns: (probs, labels) arrays of shape (N,)
+    """
+    model = get_dropout_model()
+    with inference_seconds.time(model="dropout"):
+        probs = model.predict_proba(X)[:, 1]
+    labels = (probs > 0.5).astype(int)
+    return probs, labels
 
 def suggest_interventions(risk_label, feedback_analysis):
     interventions = []
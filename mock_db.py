@@ -1,7 +1,15 @@
 # mock_db.py
+import os
+from collections import defaultdict
+
+from storage import open_storage
+
+# Storage engine: in-memory by default, or a persistent SQLite file shared by the
+# app, webhook and scheduler, e.g. TIBA_STORAGE=sqlite TIBA_DB_PATH=tiba.db
+storage = open_storage(os.getenv("TIBA_STORAGE", "memory"), os.getenv("TIBA_DB_PATH", "tiba.db"))
 
 # Example patient data structure with real data fields for advanced adherence prediction
-patients = [
+example_patients = [
     {
         'name': 'Jane Doe',
         'contact': '+254700000001',
@@ -17,35 +25,138 @@ patients = [
 # When adding or updating a patient, ensure these fields are set and updated as new feedback arrives.
 # When retrieving patients for risk prediction, extract these fields for the model input.
 
+# In-process callbacks run after each write, keyed by 'patient', 'schedule' or 'feedback'
+listeners = defaultdict(list)
+
+
+def subscribe(kind, callback):
+    """Call callback(record) whenever a record of this kind is added in this process."""
+    listeners[kind].append(callback)
+
 
-schedules = []  # List of schedule dicts
-feedback_log = []  # List of feedback dicts
+def notify(kind, record):
+    for callback in listeners[kind]:
+        callback(record)
 
 
 def add_patient(patient):
-    patients.append(patient)
+    storage.add_patient(patient)
+    notify("patient", patient)
     return patient
 
 
-def get_patients():
+def add_patients_many(patients):
+    """Write a batch of patients in one storage call."""
+    storage.add_patients_many(patients)
+    for patient in patients:
+        notify("patient", patient)
     return patients
 
 
+def get_patients():
+    return storage.get_patients()
+
+
+def get_patient(contact):
+    return storage.get_patient(contact)
+
+
+def get_patient_by_phone(phone):
+    """Look up a patient by E.164 phone number (see phone.normalize_phone)."""
+    return storage.get_patient_by_phone(phone)
+
+
+def get_patients_by_contact(contacts):
+    """contact -> patient for each of the contacts that is stored (one storage query)."""
+    return storage.get_patients_by_contact(contacts)
+
+
 def add_schedule(schedule):
-    schedules.append(schedule)
+    storage.add_schedule(schedule)
+    notify("schedule", schedule)
     return schedule
 
 
-def get_schedules():
+def add_schedules_many(schedules):
+    """Write a batch of schedules in one storage call."""
+    storage.add_schedules_many(schedules)
+    for schedule in schedules:
+        notify("schedule", schedule)
     return schedules
 
 
+def get_schedules(patient_contact=None):
+    return storage.get_schedules(patient_contact)
+
+
+def get_schedules_by_contact(contacts):
+    """contact -> schedules for each of the contacts that has any (one storage query)."""
+    return storage.get_schedules_by_contact(contacts)
+
+
 def add_feedback(feedback):
-    feedback_log.append(feedback)
+    storage.add_feedback(feedback)
+    notify("feedback", feedback)
     return feedback
 
 
-def get_feedback(patient_contact=None):
-    if patient_contact:
-        return [f for f in feedback_log if f["patient_contact"] == patient_contact]
-    return feedback_log 
\ No newline at end of file
+def add_feedback_many(feedbacks):
+    """Write a batch of feedback in one storage call."""
+    storage.add_feedback_many(feedbacks)
+    for feedback in feedbacks:
+        notify("feedback", feedback)
+    return feedbacks
+
+
+def get_feedback(patient_contact=None, medication=None, since=None):
+    return storage.get_feedback(patient_contact, medication, since)
+
+
+def get_feedback_page(limit, offset=0, medication=None, contacts=None):
+    """
+    One page of feedback, newest first, optionally only for one medication and/or
+    a collection of patient contacts. Reads only the rows on the page.
+    """
+    return storage.get_feedback_page(limit, offset, medication, contacts)
+
+
+def count_feedback(medication=None, contacts=None):
+    """Number of feedback records matching the same filters as get_feedback_page."""
+    return storage.count_feedback(medication, contacts)
+
+
+def iter_records(kind, after_id=0, chunk_size=10000):
+    """
+    Stream stored records of one kind ('patient', 'schedule', 'feedback') in
+    chunks: yields lists of (id, record) with id > after_id, oldest first.
+    """
+    return storage.iter_records(kind, after_id, chunk_size)
+
+
+def sync_feedback(*readers, chunk_size=10000):
+    """
+    Bring feedback readers (objects with a last_id and an apply(rows) method, such
+    as the risk engine, feedback store and dose index) up to date in one pass over
+    the feedback stored since the furthest-behind of them last synced, so several
+    readers don't each decode the same rows. Returns the number of records read.
+    """
+    read = 0
+    for rows in iter_records("feedback", min(reader.last_id for reader in readers), chunk_size):
+        for reader in readers:
+            reader.apply(rows)
+        read += len(rows)
+    return read
+
+
+def data_version(*kinds):
+    """
+    Monotonically increasing version of the given kinds of data ('patient',
+    'schedule', 'feedback'; all if none given). Changes whenever one is added,
+    so it can key caches of anything derived from that data.
+    """
+    return tuple(storage.version(kind) for kind in (kinds or ("patient", "schedule", "feedback")))
+
+
+if not get_patients():
+    for example in example_patients:
+        add_patient(example)
@@ -0,0 +1,152 @@
+# model_registry.py
+import argparse
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+import joblib
+
+# Versioned model artifacts live in MODEL_DIR/<version>/<name>.joblib, with a
+# LATEST file naming the version every process should load.
+MODEL_DIR = os.getenv("TIBA_MODEL_DIR", "models")
+
+_loaded = {}  # (model_dir, name) -> (version, model); only the newest version loaded is kept
+_lock = threading.Lock()
+
+
+def latest_version(model_dir=MODEL_DIR):
+    """Version named in the LATEST pointer, or None if nothing has been trained yet."""
+    try:
+        with open(os.path.join(model_dir, "LATEST")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_models(models, model_dir=MODEL_DIR, version=None, metadata=None):
+    """
+    Save a dict of name -> fitted model as a new version and point LATEST at it.
+    Returns the version string.
+    """
+    version = version or datetime.now().strftime("%Y%m%d%H%M%S%f")
+    version_dir = os.path.join(model_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+    for name, model in models.items():
+        tmp_path = os.path.join(version_dir, f"{name}.joblib.tmp")
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, os.path.join(version_dir, f"{name}.joblib"))
+    with open(os.path.join(version_dir, "metadata.json"), "w") as f:
+        json.dump({"version": version, "models": sorted(models), **(metadata or {})}, f, indent=2)
+    # Swap the pointer atomically so readers never see a half-written version
+    tmp_latest = os.path.join(model_dir, f"LATEST.{os.getpid()}.tmp")
+    with open(tmp_latest, "w") as f:
+        f.write(version)
+    os.replace(tmp_latest, os.path.join(model_dir, "LATEST"))
+    return version
+
+
+def load_metadata(model_dir=MODEL_DIR, version=None):
+    """metadata.json of a version (the latest by default), or {} if there is none."""
+    version = version or latest_version(model_dir)
+    if version is None:
+        return {}
+    try:
+        with open(os.path.join(model_dir, version, "metadata.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def update_models(models, model_dir=MODEL_DIR, metadata=None):
+    """
+    Save a new version that carries over every model (and metadata) of the latest
+    version, replacing the ones given. Returns the version string.
+    """
+    base = load_metadata(model_dir)
+    carried = {name: load_model(name, model_dir, base["version"]) for name in base.get("models", []) if name not in models}
+    merged = {key: value for key, value in base.items() if key not in ("version", "models")}
+    merged.update(metadata or {})
+    return save_models({**{name: model for name, model in carried.items() if model is not None}, **models},
+                       model_dir, metadata=merged)
+
+
+def prune_versions(model_dir=MODEL_DIR, keep=10):
+    """Delete all but the newest 'keep' versions (never the LATEST one)."""
+    latest = latest_version(model_dir)
+    versions = sorted(name for name in os.listdir(model_dir) if os.path.isdir(os.path.join(model_dir, name)))
+    for version in versions[:-keep] if keep else versions:
+        if version != latest:
+            shutil.rmtree(os.path.join(model_dir, version), ignore_errors=True)
+    with _lock:
+        for key in [key for key, (version, _) in _loaded.items() if key[0] == model_dir and version not in (latest, None)
+                    and not os.path.isdir(os.path.join(model_dir, version))]:
+            del _loaded[key]
+
+
+def load_model(name, model_dir=MODEL_DIR, version=None):
+    """
+    Load a model artifact (memory-mapping its arrays). The newest version loaded
+    of each model is cached, replacing the one it supersedes; older versions are
+    loaded without caching. Returns None if no such artifact exists.
+    """
+    version = version or latest_version(model_dir)
+    if version is None:
+        return None
+    key = (model_dir, name)
+    with _lock:
+        cached = _loaded.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        path = os.path.join(model_dir, version, f"{name}.joblib")
+        if not os.path.exists(path):
+            return None
+        model = joblib.load(path, mmap_mode="r")
+        # Versions are timestamps, so they sort in the order they were saved
+        if cached is None or version > cached[0]:
+            _loaded[key] = (version, model)
+        return model
+
+
+def get_model(name, train_fn, model_dir=MODEL_DIR):
+    """
+    Lazily load the latest version of a model. If it has never been trained,
+    train it with train_fn and save it (alongside the models already in the
+    latest version) so other processes pick up the same version.
+    """
+    model = load_model(name, model_dir)
+    if model is None:
+        print(f"[MODEL REGISTRY] No trained '{name}' model in {model_dir}, training now")
+        update_models({name: train_fn()}, model_dir, {"trained_at": datetime.now().isoformat()})
+        model = load_model(name, model_dir)
+    return model
+
+
+def train_all(model_dir=MODEL_DIR, version=None):
+    """Train every registered model offline and save them as one version."""
+    from ml_model import train_adherence_model, train_dropout_model
+    models = {
+        "adherence": train_adherence_model(),
+        "dropout": train_dropout_model(),
+    }
+    return save_models(models, model_dir, version, {"trained_at": datetime.now().isoformat()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and manage Tiba Kwa Wakati model artifacts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train", help="Train all models and save a new version")
+    train.add_argument("--model-dir", default=MODEL_DIR)
+    train.add_argument("--version", default=None)
+    latest = subparsers.add_parser("latest", help="Print the current model version")
+    latest.add_argument("--model-dir", default=MODEL_DIR)
+    args = parser.parse_args()
+    if args.command == "train":
+        print(f"Saved model version {train_all(args.model_dir, args.version)} to {args.model_dir}")
+    else:
+        print(latest_version(args.model_dir) or "No models trained yet.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# online_learning.py
+import argparse
+import atexit
+import copy
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from metrics import counter, histogram
+from model_registry import MODEL_DIR, latest_version, load_metadata, load_model, prune_versions, update_models
+from outbox import default_worker_id
+from sharding import COORDINATOR, ShardLeases
+
+MODEL_NAME = "adherence_online"
+# Responses the adherence model can learn from: 1 = non-adherent (high risk), as in ml_model.Y
+LABELS = {"yes": 0, "no": 1, "delay": 1}
+# Live examples needed before predictions switch from the offline model to the online one
+MIN_EXAMPLES = int(os.getenv("TIBA_ONLINE_MIN_EXAMPLES", "200"))
+FEEDBACK_WINDOW = timedelta(days=7)  # feedback_count feature window, as in build_feature_matrix
+# How long current_model() trusts its idea of the latest checkpoint before re-reading the registry
+CHECKPOINT_TTL = float(os.getenv("TIBA_ONLINE_CHECKPOINT_TTL", "30"))
+
+examples_learned = counter("tiba_online_examples_total", "Feedback examples the online model has learned from")
+update_seconds = histogram("tiba_online_update_seconds", "Time per online model mini-batch update")
+
+
+class OnlineRiskModel:
+    """
+    Logistic regression trained by SGD, one mini-batch at a time. Features are
+    standardized with running statistics (StandardScaler.partial_fit), since the
+    raw columns (rates, ages, counts) are on very different scales. Has the
+    predict_proba/predict/coef_ interface ml_model expects of the offline model.
+    """
+
+    def __init__(self, alpha=1e-4, eta0=0.01, seed=42):
+        self.scaler = StandardScaler()
+        # A constant step keeps the model tracking drift instead of freezing as updates accumulate
+        self.classifier = SGDClassifier(loss="log_loss", alpha=alpha, learning_rate="constant", eta0=eta0, random_state=seed)
+        self.n_examples = 0  # live feedback examples (the offline seed rows don't count)
+
+    def partial_fit(self, X, y, live=True):
+        X = np.asarray(X, dtype=float)
+        self.scaler.partial_fit(X)
+        self.classifier.partial_fit(self.scaler.transform(X), y, classes=np.array([0, 1]))
+        if live:
+            self.n_examples += len(y)
+        return self
+
+    def predict_proba(self, X):
+        return self.classifier.predict_proba(self.scaler.transform(np.asarray(X, dtype=float)))
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+    @property
+    def coef_(self):
+        # Per standardized feature, so magnitudes are comparable across features
+        return self.classifier.coef_
+
+
+def seed_model():
+    """A new online model started from the offline training rows, so it is usable from the first update."""
+    from ml_model import X, Y
+    return OnlineRiskModel().partial_fit(X, Y, live=False)
+
+
+class OnlineLearner:
+    """
+    Keeps the online adherence model current with the feedback log. A background
+    thread reads feedback added since its watermark (from any process sharing the
+    storage), turns yes/no/delay responses into examples, and updates a copy of the
+    model one mini-batch at a time; the updated copy is swapped in under a lock,
+    so predictions never see a half-updated model. Every checkpoint_interval
+    seconds the model and its watermark are saved together as a new model registry
+    version, which other processes pick up and a restart resumes from.
+
+    Only the holder of a lease in the model directory learns (as sharding.py
+    leases shards), so a learner in the webhook and one run from the command line
+    never both write checkpoints; the other stands by and takes over, from the
+    latest checkpoint, if the holder stops renewing it.
+    """
+
+    def __init__(self, batch_size=256, poll_interval=5.0, checkpoint_interval=300.0, model_dir=MODEL_DIR,
+                 lease_seconds=30.0):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.model_dir = model_dir
+        self.lock = threading.Lock()
+        os.makedirs(model_dir, exist_ok=True)
+        # A lease file with no shards: its coordinator lease is the learner role
+        self.leases = ShardLeases(os.path.join(model_dir, "online_learner.db"), num_shards=0, lease_seconds=lease_seconds)
+        self.worker_id = default_worker_id()
+        self.active = False  # holds the lease
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.resume()
+
+    def resume(self):
+        """Load the model and watermark from the latest checkpoint and rebuild the feature window."""
+        self.version = latest_version(self.model_dir)
+        model = load_model(MODEL_NAME, self.model_dir, self.version) if self.version else None
+        if model is None:
+            model = seed_model()
+            self.watermark = 0
+        else:
+            model = copy.deepcopy(model)  # writable copy of the memory-mapped checkpoint
+            self.watermark = load_metadata(self.model_dir, self.version).get("feedback_watermark", 0)
+        with self.lock:
+            self.model = model
+        self.checkpointed = model.n_examples  # live examples in the last saved version
+        self.recent = self._recent_feedback()
+
+    def _recent_feedback(self):
+        """contact -> timestamps of feedback in the last FEEDBACK_WINDOW, as of the watermark."""
+        from mock_db import get_feedback, iter_records
+        since = (datetime.now() - FEEDBACK_WINDOW).isoformat()
+        # Feedback past the watermark is added to the window as it is learned from, so leave it out here
+        unlearned = Counter(
+            (feedback.get("patient_contact"), str(feedback.get("timestamp")))
+            for rows in iter_records("feedback", self.watermark, self.batch_size)
+            for _, feedback in rows
+            if str(feedback.get("timestamp")) >= since
+        )
+        recent = defaultdict(deque)
+        for feedback in get_feedback(since=since):
+            key = (feedback.get("patient_contact"), str(feedback.get("timestamp")))
+            if unlearned[key]:
+                unlearned[key] -= 1
+                continue
+            try:
+                recent[key[0]].append(datetime.fromisoformat(key[1]))
+            except ValueError:
+                continue
+        return recent
+
+    def acquire_lease(self):
+        """Take or renew the learner lease. Returns True while this learner holds it."""
+        held = self.leases.acquire(COORDINATOR, self.worker_id)
+        if held and not self.active:
+            if latest_version(self.model_dir) != self.version:
+                self.resume()  # another learner checkpointed since we loaded
+            print(f"[ONLINE] {self.worker_id} is now the online learner")
+        elif not held and self.active:
+            print(f"[ONLINE] {self.worker_id} lost the online learner lease; standing by")
+        self.active = held
+        return held
+
+    def current(self):
+        """The online model, once it has learned from MIN_EXAMPLES live responses; otherwise None."""
+        with self.lock:
+            return self.model if self.model.n_examples >= MIN_EXAMPLES else None
+
+    def _examples(self, rows):
+        from mock_db import get_patient
+        from ml_model import build_feature_matrix
+        patients, counts, labels = [], [], []
+        cache = {}
+        for _, feedback in rows:
+            label = LABELS.get(feedback.get("response"))
+            if label is None:
+                continue  # free text and 'unknown' replies say nothing about the dose
+            try:
+                ts = datetime.fromisoformat(str(feedback.get("timestamp")))
+            except ValueError:
+                continue
+            contact = feedback.get("patient_contact")
+            if contact not in cache:
+                cache[contact] = get_patient(contact)
+            if cache[contact] is None:
+                continue
+            # feedback_count as the model would have seen it just before this response
+            window = self.recent[contact]
+            while window and window[0] < ts - FEEDBACK_WINDOW:
+                window.popleft()
+            patients.append(cache[contact])
+            counts.append(len(window))
+            labels.append(label)
+            window.append(ts)
+        if not patients:
+            return None, None
+        X = build_feature_matrix(patients, feedback_counts={})
+        X[:, 3] = counts
+        return X, np.array(labels)
+
+    def learn(self, rows):
+        """Update the model from (id, feedback) rows and swap it in. Returns the number of examples used."""
+        X, y = self._examples(rows)
+        if X is not None:
+            with update_seconds.time():
+                candidate = copy.deepcopy(self.model)
+                candidate.partial_fit(X, y)
+            with self.lock:
+                self.model = candidate
+            examples_learned.inc(len(y))
+        self.watermark = rows[-1][0]
+        return 0 if y is None else len(y)
+
+    def poll(self):
+        """Learn from all feedback added since the watermark. Returns the number of examples used."""
+        from mock_db import iter_records
+        learned = 0
+        for rows in iter_records("feedback", self.watermark, self.batch_size):
+            learned += self.learn(rows)
+            if not self.acquire_lease():
+                break  # renewed per batch, so a long catch-up doesn't let the lease lapse
+        return learned
+
+    def checkpoint(self):
+        """
+        Save the model and its watermark as a new registry version, only if it has
+        learned from new examples since the last one (feedback that taught it nothing
+        is just re-read after a restart, which is cheaper than a new version).
+        """
+        with self.lock:
+            model = self.model
+        if not self.active or model.n_examples == self.checkpointed:
+            return None
+        version = self.version = update_models({MODEL_NAME: model}, self.model_dir, {
+            "feedback_watermark": self.watermark,
+            "online_examples": model.n_examples,
+            "checkpointed_at": datetime.now().isoformat(),
+        })
+        self.checkpointed = model.n_examples
+        prune_versions(self.model_dir)
+        print(f"[ONLINE] Checkpointed {MODEL_NAME} ({model.n_examples} examples) as version {version}")
+        return version
+
+    def _run(self):
+        last_checkpoint = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                if self.acquire_lease():
+                    self.poll()
+                    if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                        self.checkpoint()
+                        last_checkpoint = time.monotonic()
+            except Exception as e:
+                print(f"[ONLINE ERROR] Online model update failed: {e}")
+            self.wakeup.wait(min(self.poll_interval, self.leases.lease_seconds / 3))
+            self.wakeup.clear()
+
+    def start(self):
+        from mock_db import subscribe
+        # New feedback in this process wakes the thread early; feedback from other processes is polled
+        subscribe("feedback", lambda feedback: self.wakeup.set())
+        self.thread = threading.Thread(target=self._run, name="online-learner", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+        if self.active:
+            self.checkpoint()
+            self.leases.release(COORDINATOR, self.worker_id)
+            self.active = False
+
+
+_learner = None
+_learner_lock = threading.Lock()
+_checkpoint_cache = {}  # model_dir -> (checked_at, version, model or None)
+
+
+def get_learner():
+    """Start the process's online learner (once); it learns only while it holds the learner lease."""
+    global _learner
+    with _learner_lock:
+        if _learner is None:
+            _learner = OnlineLearner().start()
+            atexit.register(_learner.stop)
+        return _learner
+
+
+def current_model(model_dir=MODEL_DIR):
+    """
+    The online adherence model if it is ready to replace the offline one: the
+    live model when this process is the active learner, otherwise the latest
+    checkpoint (looked up at most every CHECKPOINT_TTL seconds). None until
+    MIN_EXAMPLES live responses have been learned from.
+    """
+    if _learner is not None and _learner.active:
+        return _learner.current()
+    now = time.monotonic()
+    cached = _checkpoint_cache.get(model_dir)
+    if cached is not None and now - cached[0] < CHECKPOINT_TTL:
+        return cached[2]
+    version = latest_version(model_dir)
+    if cached is None or cached[1] != version:
+        model = load_model(MODEL_NAME, model_dir, version) if version else None
+        model = model if model is not None and model.n_examples >= MIN_EXAMPLES else None
+    else:
+        model = cached[2]
+    _checkpoint_cache[model_dir] = (now, version, model)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the online adherence model from live feedback.")
+    parser.add_argument("command", choices=["run", "catch-up"],
+                        help="run: keep learning until stopped; catch-up: learn from stored feedback once and checkpoint")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--checkpoint-interval", type=float, default=300.0)
+    args = parser.parse_args()
+    if os.getenv("TIBA_STORAGE", "memory") == "memory":
+        print("[ONLINE] Warning: TIBA_STORAGE is 'memory', so only this process's feedback is seen. Use TIBA_STORAGE=sqlite.")
+    learner = OnlineLearner(args.batch_size, args.poll_interval, args.checkpoint_interval)
+    if args.command == "catch-up":
+        if not learner.acquire_lease():
+            print("[ONLINE ERROR] Another process is running the online learner; not catching up")
+            sys.exit(1)
+        print(f"[ONLINE] Learned from {learner.poll()} feedback responses")
+        learner.checkpoint()
+        return
+    if not learner.acquire_lease():
+        print("[ONLINE] Another process is running the online learner; standing by to take over")
+    learner.start()
+    try:
+        while learner.thread.is_alive():
+            learner.thread.join(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        learner.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# outbox.py
+import argparse
+import os
+import socket
+import threading
+import time
+
+from storage import ConnectionPool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    contact TEXT NOT NULL,
+    medication TEXT,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    scheduled_minute INTEGER,
+    date TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, sent, dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_ready ON outbox (status, available_at);
+
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    outbox_id INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    medication TEXT,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+COLUMNS = ["id", "idempotency_key", "contact", "medication", "channel", "message", "scheduled_minute", "date", "attempts"]
+
+
+def idempotency_key(contact, medication, scheduled_minute, date, channel):
+    """One reminder per patient, medication, dose time, day and channel."""
+    return f"{contact}|{medication}|{scheduled_minute}|{date}|{channel}"
+
+
+class Outbox:
+    """
+    Persistent queue of outbound reminders (SQLite, WAL mode). Reminders survive
+    restarts, are delivered at least once, and the idempotency key stops a re-run
+    tick from sending the same dose reminder twice. Workers in any number of
+    processes lease batches; leases that expire (e.g. the worker crashed) are
+    picked up again, and reminders that keep failing go to the dead_letter table.
+    """
+
+    def __init__(self, path="outbox.db", max_attempts=5, lease_seconds=60, retry_backoff=30, pool_size=5):
+        self.pool = ConnectionPool(path, size=pool_size)
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def enqueue(self, contact, medication, channel, message, scheduled_minute, date):
+        """Add a reminder. Returns False if it was already queued (or sent)."""
+        key = idempotency_key(contact, medication, scheduled_minute, date, channel)
+        now = time.time()
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, contact, medication, channel, message, "
+                "scheduled_minute, date, available_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, contact, medication, channel, message, scheduled_minute, date, now, now),
+            )
+        return cur.rowcount == 1
+
+    def lease(self, worker_id, limit=100):
+        """Claim up to 'limit' ready reminders for this worker. Returns a list of dicts."""
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # serialize leasing across processes
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM outbox "
+                "WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY available_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(worker_id, now + self.lease_seconds, row[0]) for row in rows],
+            )
+        leased = [dict(zip(COLUMNS, row)) for row in rows]
+        for item in leased:
+            item["attempts"] += 1
+        return leased
+
+    def ack(self, item_id, worker_id):
+        """Mark a leased reminder as sent."""
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND lease_owner = ?",
+                (time.time(), item_id, worker_id),
+            )
+
+    def fail(self, item_id, worker_id, error):
+        """Return a reminder to the queue with backoff, or dead-letter it after max_attempts."""
+        now = time.time()
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM outbox WHERE id = ? AND lease_owner = ?", (item_id, worker_id)
+            ).fetchone()
+            if row is None:
+                return  # lease lost to another worker
+            item = dict(zip(COLUMNS, row))
+            if item["attempts"] >= self.max_attempts:
+                conn.execute(
+                    "INSERT INTO dead_letter (outbox_id, idempotency_key, contact, medication, channel, message, "
+                    "attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (item["id"], item["idempotency_key"], item["contact"], item["medication"], item["channel"],
+                     item["message"], item["attempts"], str(error), now),
+                )
+                status, available_at = "dead", now
+            else:
+                status, available_at = "pending", now + self.retry_backoff * 2 ** (item["attempts"] - 1)
+            conn.execute(
+                "UPDATE outbox SET status = ?, available_at = ?, last_error = ?, lease_owner = NULL, "
+                "lease_expires = NULL WHERE id = ?",
+                (status, available_at, str(error), item_id),
+            )
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            counts["dead_letter"] = conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return counts
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def drain(outbox, dispatcher, worker_id=None, batch_size=100):
+    """
+    Lease and send ready reminders until none are left. Each reminder is acked or
+    failed from the dispatcher's completion callback. Returns the number leased.
+    """
+    worker_id = worker_id or default_worker_id()
+    total = 0
+    while True:
+        batch = outbox.lease(worker_id, batch_size)
+        if not batch:
+            return total
+        total += len(batch)
+        futures = []
+        for item in batch:
+            future = dispatcher.submit(item["channel"], item["contact"], item["message"])
+            future.add_done_callback(
+                lambda f, item_id=item["id"]: outbox.fail(item_id, worker_id, f.exception())
+                if f.exception() else outbox.ack(item_id, worker_id)
+            )
+            futures.append(future)
+        for future in futures:
+            future.exception()  # wait so the next lease doesn't re-claim in-flight reminders
+
+
+def run_worker(outbox, dispatcher, worker_id=None, batch_size=100, poll_interval=1.0, stop_event=None):
+    """Keep draining the outbox until stop_event is set."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        if not drain(outbox, dispatcher, worker_id, batch_size):
+            stop_event.wait(poll_interval)
+
+
+def main():
+    from dispatcher import Dispatcher
+    parser = argparse.ArgumentParser(description="Reminder outbox worker.")
+    parser.add_argument("command", choices=["worker", "stats"])
+    parser.add_argument("--path", default=os.getenv("TIBA_OUTBOX_PATH", "outbox.db"))
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    outbox = Outbox(args.path)
+    if args.command == "stats":
+        print(outbox.stats())
+    else:
+        run_worker(outbox, Dispatcher(), args.worker_id, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# phone.py
+import re
+
+# Country calling codes for the supported countries
+COUNTRY_CODES = {
+    "Kenya": "254",
+    "Uganda": "256",
+    "Tanzania": "255",
+    "Rwanda": "250",
+}
+
+E164 = re.compile(r"^\+[1-9]\d{7,14}$")
+
+
+def normalize_phone(number, country=None):
+    """
+    Normalize a phone number to E.164 ('+254712345678').
+    Handles 'whatsapp:'/'tel:' prefixes, spaces and punctuation, '00' international
+    prefixes, and local numbers ('0712 345 678') when the country is known.
+    Returns None if the result isn't a plausible E.164 number.
+    """
+    if not number:
+        return None
+    number = str(number).strip()
+    for prefix in ("whatsapp:", "tel:"):
+        if number.lower().startswith(prefix):
+            number = number[len(prefix):]
+    plus = number.startswith("+")
+    digits = re.sub(r"\D", "", number)
+    if plus:
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif any(digits.startswith(code) and len(digits) == 12 for code in COUNTRY_CODES.values()):
+        pass
+    elif country in COUNTRY_CODES:
+        digits = COUNTRY_CODES[country] + (digits[1:] if digits.startswith("0") else digits)
+    normalized = "+" + digits
+    return normalized if E164.match(normalized) else None
@@ -1,6 +1,10 @@
+import os
 import random
+import threading
 from collections import defaultdict
 
+import numpy as np
+
 class PersonalizedBandit:
     def __init__(self, arms, epsilon=0.1):
         self.arms = arms  # List of tuples: (channel, time, message_type)
@@ -21,6 +25,109 @@ class PersonalizedBandit:
         self.counts[patient_id][arm_index] += 1
         self.successes[patient_id][arm_index] += reward  # reward: 1=adhered, 0=not
 
+STRATEGIES = ("epsilon", "ucb", "thompson")
+
+class VectorizedBandit:
+    """
+    Bandit over the same arms for many patients at once. Counts and successes are
+    (patients x arms) NumPy matrices, so a whole tick's worth of due patients is
+    scored and updated in a few array operations. Strategies:
+      "epsilon"  - epsilon-greedy (same rule as PersonalizedBandit)
+      "ucb"      - UCB1: success rate plus an exploration bonus; untried arms first
+      "thompson" - Thompson sampling from Beta(1 + successes, 1 + failures)
+    State is saved to an .npz checkpoint so learning survives restarts.
+    """
+
+    def __init__(self, arms, strategy="epsilon", epsilon=0.1, ucb_c=2.0, seed=None, capacity=1024):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown bandit strategy: {strategy}")
+        self.arms = arms
+        self.strategy = strategy
+        self.epsilon = epsilon
+        self.ucb_c = ucb_c
+        self.rng = np.random.default_rng(seed)
+        self.patients = []  # row -> patient_id
+        self.rows = {}  # patient_id -> row
+        self.counts = np.zeros((capacity, len(arms)))
+        self.successes = np.zeros((capacity, len(arms)))
+        self.lock = threading.Lock()
+
+    def _rows(self, patient_ids):
+        # Row of every patient, adding (and growing the matrices for) new ones
+        for patient_id in patient_ids:
+            if patient_id not in self.rows:
+                self.rows[patient_id] = len(self.patients)
+                self.patients.append(patient_id)
+        if len(self.patients) > len(self.counts):
+            extra = max(len(self.patients), 2 * len(self.counts)) - len(self.counts)
+            self.counts = np.vstack([self.counts, np.zeros((extra, len(self.arms)))])
+            self.successes = np.vstack([self.successes, np.zeros((extra, len(self.arms)))])
+        return np.array([self.rows[patient_id] for patient_id in patient_ids], dtype=int)
+
+    def select_arms(self, patient_ids):
+        """Arm index for each patient in patient_ids (one array operation per strategy)."""
+        n, k = len(patient_ids), len(self.arms)
+        if n == 0:
+            return np.zeros(0, dtype=int)
+        # numpy Generators aren't thread-safe, so the random draws happen under the lock too
+        with self.lock:
+            rows = self._rows(patient_ids)
+            counts, successes = self.counts[rows], self.successes[rows]
+            if self.strategy == "thompson":
+                samples = self.rng.beta(1 + successes, 1 + counts - successes)
+            elif self.strategy == "ucb":
+                noise = self.rng.random((n, k))
+            else:
+                random_arms = self.rng.integers(0, k, size=n)
+                coins = self.rng.random(n)
+        if self.strategy == "thompson":
+            return samples.argmax(axis=1)
+        rates = np.divide(successes, counts, out=np.zeros_like(counts), where=counts > 0)
+        if self.strategy == "ucb":
+            total = counts.sum(axis=1, keepdims=True)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scores = rates + np.sqrt(self.ucb_c * np.log(np.maximum(total, 1)) / counts)
+            # Untried arms come first, in random order; the noise also breaks ties between tried arms
+            scores = np.where(counts == 0, 1e12 + noise, scores + noise * 1e-9)
+            return scores.argmax(axis=1)
+        greedy = rates.argmax(axis=1)
+        explore = (coins < self.epsilon) | (counts.sum(axis=1) == 0)
+        return np.where(explore, random_arms, greedy)
+
+    def select_arm(self, patient_id):
+        return int(self.select_arms([patient_id])[0])
+
+    def update(self, patient_ids, arm_indices, rewards):
+        """Record rewards (1=adhered, 0=not) for many (patient, arm) pairs at once."""
+        with self.lock:
+            rows = self._rows(patient_ids)
+            arm_indices = np.asarray(arm_indices, dtype=int)
+            np.add.at(self.counts, (rows, arm_indices), 1)
+            np.add.at(self.successes, (rows, arm_indices), np.asarray(rewards, dtype=float))
+
+    def save(self, path):
+        with self.lock:
+            n = len(self.patients)
+            state = dict(patients=np.array(self.patients, dtype=str), counts=self.counts[:n],
+                         successes=self.successes[:n], arms=np.array(["|".join(arm) for arm in self.arms]))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **state)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore counts from a checkpoint; ignored if it was saved for different arms."""
+        with np.load(path) as data:
+            if list(data["arms"]) != ["|".join(arm) for arm in self.arms]:
+                print(f"[BANDIT] Ignoring checkpoint {path}: arms have changed")
+                return self
+            patients, counts, successes = list(data["patients"]), data["counts"], data["successes"]
+        with self.lock:
+            rows = self._rows(patients)
+            self.counts[rows] = counts
+            self.successes[rows] = successes
+        return self
+
 # Example usage:
 if __name__ == "__main__":
     arms = [
@@ -35,4 +142,15 @@ if __name__ == "__main__":
         print("Selected:", arms[arm])
         # Simulate a response (random for demo)
         reward = random.choice([0, 1])
-        bandit.update(patient_id, arm, reward) 
\ No newline at end of file
+        bandit.update(patient_id, arm, reward) 
+    vbandit = VectorizedBandit(arms, strategy="thompson", seed=0)
+    patients = [f"patient_{i}" for i in range(5)]
+    for _ in range(20):
+        chosen = vbandit.select_arms(patients)
+        # Simulate responses: every patient prefers the WhatsApp arm
+        vbandit.update(patients, chosen, (chosen == 1).astype(int))
+    print("Thompson picks:", [arms[i][0] for i in vbandit.select_arms(patients)])
+    # New patients under UCB start on a random untried arm, not all on the first one
+    first_arms = VectorizedBandit(arms, strategy="ucb", seed=0).select_arms([f"new_{i}" for i in range(30)])
+    print("UCB first arms:", np.bincount(first_arms, minlength=len(arms)))
+    assert len(set(first_arms.tolist())) == len(arms), "UCB should spread new patients across arms"
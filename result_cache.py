@@ -0,0 +1,86 @@
+# result_cache.py
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}  # worker count -> ProcessPoolExecutor
+_pool_lock = threading.Lock()
+
+
+def content_key(data, *params):
+    """SHA-1 hex digest of some bytes plus any parameters that change the result."""
+    digest = hashlib.sha1(data)
+    for param in params:
+        digest.update(f":{param}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of computed results keyed by content hash, safe to share
+    between threads. Values go in and come out through copy_value, so callers
+    can't change a cached result by mutating what they were given; pass
+    copy_value=None for values that are already immutable (e.g. read-only arrays).
+    """
+
+    def __init__(self, max_entries, copy_value=copy.deepcopy):
+        self.max_entries = max_entries
+        self.copy_value = copy_value or (lambda value: value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        """Cached value for each key, or None where there is none."""
+        results = []
+        with self.lock:
+            for key in keys:
+                value = self.entries.get(key)
+                if value is not None:
+                    self.entries.move_to_end(key)
+                results.append(value)
+        return [None if value is None else self.copy_value(value) for value in results]
+
+    def put_many(self, items):
+        """Cache key -> value pairs, evicting the least recently used entries beyond max_entries."""
+        items = [(key, self.copy_value(value)) for key, value in items]
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def get_pool(workers):
+    """Process pool of 'workers' processes, shared by every caller asking for that size and created on first use."""
+    with _pool_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+        return _pools[workers]
+
+
+def parallel_map(fn, items, *iterables, workers=None, min_parallel=8):
+    """
+    [fn(item, ...) for each item], spread over the process pool when there are at
+    least min_parallel items and more than one worker, otherwise run in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if len(items) < min_parallel or workers == 1:
+        return [fn(*args) for args in zip(items, *iterables)]
+    chunksize = max(1, len(items) // (workers * 4))
+    return list(get_pool(workers).map(fn, items, *iterables, chunksize=chunksize))
+
+
+# Example usage:
+if __name__ == "__main__":
+    cache = ResultCache(max_entries=2)
+    keys = [content_key(text.encode("utf-8")) for text in ["yes", "no", "delay"]]
+    cache.put_many(zip(keys, [{"n": 1}, {"n": 2}, {"n": 3}]))
+    print("Cached:", cache.get_many(keys))  # "yes" was evicted
+    print("Squares:", parallel_map(pow, [1, 2, 3], [2, 2, 2]))
@@ -0,0 +1,98 @@
+# risk_engine.py
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+
+from mock_db import sync_feedback
+
+NONADHERENT = ("no", "delay")
+
+
+class PatientRiskState:
+    """Ring buffer of a patient's last 'window' responses plus running risk and anomalies."""
+
+    __slots__ = ("recent", "nonadherent", "risk", "trend", "anomalies")
+
+    def __init__(self, window, history):
+        self.recent = deque(maxlen=window)  # 1 = non-adherent, 0 = adherent
+        self.nonadherent = 0  # running count of 1s in 'recent'
+        self.risk = None
+        self.trend = deque(maxlen=history)  # (timestamp, risk)
+        self.anomalies = deque(maxlen=history)  # (timestamp, description)
+
+
+def _format_timestamp(ts):
+    # Same format risk_trend produces ('2024-01-01 08:00:00')
+    if isinstance(ts, str):
+        try:
+            return str(datetime.fromisoformat(ts))
+        except ValueError:
+            return ts
+    return str(ts)
+
+
+class RiskEngine:
+    """
+    Incremental version of predict_nonadherence, risk_trend and detect_anomalies.
+    Each feedback event updates its patient's rolling risk and anomaly checks in
+    O(1), so readers get precomputed values instead of rescanning the feedback log.
+    sync() applies the feedback stored since the last call, whichever process
+    wrote it. Responses are taken in storage order; trend and anomaly history keep
+    the last 'history' points per patient.
+    """
+
+    def __init__(self, window=5, history=500):
+        self.window = window
+        self.history = history
+        self.states = defaultdict(lambda: PatientRiskState(window, history))
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.last_id = 0  # storage id of the last feedback record applied
+
+    def observe(self, feedback):
+        flag = int(feedback.get("response") in NONADHERENT)
+        ts = _format_timestamp(feedback.get("timestamp"))
+        with self.lock:
+            state = self.states[feedback["patient_contact"]]
+            if len(state.recent) == state.recent.maxlen:
+                state.nonadherent -= state.recent[0]
+            state.recent.append(flag)
+            state.nonadherent += flag
+            prev_risk, risk = state.risk, state.nonadherent / len(state.recent)
+            state.risk = risk
+            state.trend.append((ts, risk))
+            if prev_risk is not None:
+                if (risk - prev_risk) > 0.5:
+                    state.anomalies.append((ts, f"Sudden risk increase: {prev_risk:.2f} → {risk:.2f}"))
+                if prev_risk < 0.33 and risk > 0.66:
+                    state.anomalies.append((ts, f"Risk jump from low to high: {prev_risk:.2f} → {risk:.2f}"))
+
+    def apply(self, rows):
+        """Apply (id, feedback) rows from mock_db.iter_records, skipping ones already applied. Returns how many were."""
+        with self.sync_lock:
+            rows = [row for row in rows if row[0] > self.last_id]
+            for _, feedback in rows:
+                self.observe(feedback)
+            if rows:
+                self.last_id = rows[-1][0]
+        return len(rows)
+
+    def sync(self):
+        """Apply feedback stored since the last sync. Returns the number of records read."""
+        return sync_feedback(self)
+
+    def risk(self, patient_contact):
+        state = self.states.get(patient_contact)
+        return state.risk if state else 0.0  # No data, assume low risk
+
+    def summary(self, patient_contact):
+        """Current risk, rolling risk trend and anomalies: {"risk": float, "trend": [(timestamp, risk)], "anomalies": [(timestamp, description)]}."""
+        with self.lock:
+            state = self.states.get(patient_contact)
+            if state is None:
+                return {"risk": 0.0, "trend": [], "anomalies": []}
+            return {"risk": state.risk, "trend": list(state.trend), "anomalies": list(state.anomalies)}
+
+
+# Shared engine; readers call engine.sync() (or mock_db.sync_feedback) to pick up feedback
+engine = RiskEngine()
@@ -1,10 +1,14 @@
 # scheduler.py
 from apscheduler.schedulers.background import BackgroundScheduler
-from mock_db import get_schedules, get_patients, patients
-from messaging import send_sms, send_whatsapp, send_voice
-from translate import translate
+from mock_db import get_patient, get_patients, get_schedules, subscribe
+from dispatcher import Dispatcher
+from outbox import Outbox, drain
+from due_queue import DueQueue, load_watermark, save_watermark
+from metrics import COUNT_BUCKETS, counter, histogram, profile, serve as serve_metrics
+import os
+from translate import get_template_translator, render_message
 import datetime
-from reminder_optimization import PersonalizedBandit
+from reminder_optimization import VectorizedBandit
 import random
 
 scheduler = BackgroundScheduler()
@@ -18,41 +22,130 @@ arms = [
     ("WhatsApp", "6pm", "urgent"),
     ("Voice", "12pm", "simple"),
 ]
-bandit = PersonalizedBandit(arms)
-
-# Helper to parse schedule times (e.g., '8:00, 20:00')
-def parse_times(times_str):
-    return [t.strip() for t in times_str.split(",") if t.strip()]
-
-def check_and_send_reminders():
-    now = datetime.datetime.now().strftime("%H:%M")
-    schedules = get_schedules()
-    patients = get_patients()
-    for sched in schedules:
-        times = parse_times(sched["schedule"])
-        if now in times:
-            patient = next((p for p in patients if p["contact"] == sched["patient_contact"]), None)
-            if patient:
-                # Select best arm for this patient
-                arm_index = bandit.select_arm(patient["contact"])
-                channel, time, message_type = arms[arm_index]
-                msg = translate(f"Hello {patient['name']}, it's time to take your {sched['medication']}!", patient["language"])
-                # Schedule/send reminder using selected parameters (mocked)
-                print(f"Scheduling {channel} reminder at {time} with '{message_type}' message for {patient['name']}")
-                send_sms(patient["contact"], msg)
-                send_whatsapp(patient["contact"], msg)
-                send_voice(patient["contact"], msg)
-                # After feedback is received (mocked here)
-                feedback = random.choice([0, 1])  # 1=adhered, 0=not
-                bandit.update(patient["contact"], arm_index, feedback)
-                print(f"Feedback received: {'adhered' if feedback else 'not adhered'}")
-
-# Start the scheduler
-scheduler.add_job(check_and_send_reminders, 'interval', minutes=1)
+# Per-patient arm statistics, checkpointed after every tick so learning survives restarts
+BANDIT_PATH = os.getenv("TIBA_BANDIT_PATH", "bandit_state.npz")
+bandit = VectorizedBandit(arms, strategy=os.getenv("TIBA_BANDIT_STRATEGY", "epsilon"))
+if os.path.exists(BANDIT_PATH):
+    bandit.load(BANDIT_PATH)
+
+# Reminder message templates per message type; translated once per language and cached
+MESSAGE_TEMPLATES = {
+    "friendly": "Hello {name}, it's time to take your {medication}!",
+    "urgent": "{name}, please take your {medication} now.",
+    "simple": "Time to take your {medication}.",
+}
+LANGUAGES = ["English", "Swahili", "Kinyarwanda", "Luganda"]
+
+# Sends reminders in parallel with per-channel concurrency and rate limits
+dispatcher = Dispatcher()
+# Durable queue of reminders: survives restarts and de-duplicates re-run ticks
+outbox = Outbox(os.getenv("TIBA_OUTBOX_PATH", "outbox.db"))
+
+# Next fire time of every schedule, in the patient's local time zone
+WATERMARK_PATH = os.getenv("TIBA_WATERMARK_PATH", "scheduler_state.json")
+due_queue = None
+
+tick_seconds = histogram("tiba_scheduler_tick_seconds", "Time spent in one scheduler tick")
+due_doses = histogram("tiba_scheduler_due_doses", "Doses due per scheduler tick", COUNT_BUCKETS)
+reminders_queued = counter("tiba_reminders_queued_total", "Reminders added to the outbox")
+
+def build_due_queue(watermark=None):
+    queue = DueQueue(watermark)
+    for sched in get_schedules():
+        queue.add_schedule(sched, get_patient(sched["patient_contact"]))
+    return queue
+
+def on_schedule_added(sched):
+    if due_queue is not None:
+        due_queue.add_schedule(sched, get_patient(sched["patient_contact"]))
+        wake()
+
+@tick_seconds.time()
+@profile("scheduler_tick")
+def check_and_send_reminders(now=None, reward_fn=None):
+    """
+    Queue and send every reminder due by 'now'. reward_fn(patient, arm_index) -> 0/1
+    stands in for the patient's response (random if not given); the simulator uses it
+    to replay known response models.
+    """
+    global due_queue
+    if due_queue is None:
+        due_queue = build_due_queue(load_watermark(WATERMARK_PATH))
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    # Everything due since the last run, including doses a late run would have skipped
+    process_due(due_queue.pop_due(now), reward_fn)
+    save_watermark(WATERMARK_PATH, due_queue.watermark)
+    # Deliver everything queued (including retries left over from earlier ticks)
+    drain(outbox, dispatcher)
+
+def process_due(due_items, reward_fn=None, shard_bandit=None, bandit_path=None):
+    """
+    Pick a strategy for and queue the reminders of doses popped from a DueQueue
+    ((fire_at, schedule, minute, tz) tuples). Sharded workers pass their own bandit
+    and checkpoint path; otherwise the module's bandit is used.
+    """
+    active_bandit = shard_bandit or bandit
+    due = []
+    for fire_at, sched, minute, tz in due_items:
+        local_date = fire_at.astimezone(tz).date()
+        if sched.get("start_date") and local_date.isoformat() < sched["start_date"]:
+            continue
+        patient = get_patient(sched["patient_contact"])
+        if patient:
+            due.append((sched, minute, local_date, patient))
+    due_doses.observe(len(due))
+    # Select the best arm for every due patient at once
+    arm_indices = active_bandit.select_arms([patient["contact"] for _, _, _, patient in due])
+    rewarded, chosen, rewards = [], [], []
+    for (sched, minute, local_date, patient), arm_index in zip(due, arm_indices):
+        channel, time, message_type = arms[arm_index]
+        msg = render_message(MESSAGE_TEMPLATES[message_type], patient.get("language", "English"), name=patient["name"], medication=sched["medication"])
+        # Schedule/send reminder using selected parameters (mocked)
+        print(f"Scheduling {channel} reminder at {time} with '{message_type}' message for {patient['name']}")
+        queued = [
+            outbox.enqueue(patient["contact"], sched["medication"], reminder_channel, msg, minute, local_date.isoformat())
+            for reminder_channel in CHANNELS
+        ]
+        if not any(queued):
+            continue  # already queued by an earlier run of this tick
+        for reminder_channel, was_queued in zip(CHANNELS, queued):
+            if was_queued:
+                reminders_queued.inc(channel=reminder_channel)
+        # After feedback is received (mocked here)
+        feedback = reward_fn(patient, arm_index) if reward_fn else random.choice([0, 1])  # 1=adhered, 0=not
+        rewarded.append(patient["contact"])
+        chosen.append(arm_index)
+        rewards.append(feedback)
+        print(f"Feedback received: {'adhered' if feedback else 'not adhered'}")
+    if rewarded:
+        active_bandit.update(rewarded, chosen, rewards)
+        active_bandit.save(bandit_path or BANDIT_PATH)
+
+def run_due_reminders():
+    """Send what's due, then sleep until the next fire time instead of polling."""
+    try:
+        check_and_send_reminders()
+    finally:
+        next_due = due_queue.next_due() if due_queue is not None else None
+        if next_due is not None:
+            scheduler.add_job(run_due_reminders, 'date', run_date=next_due, id='reminders',
+                              replace_existing=True, misfire_grace_time=None)
+
+def wake():
+    # Re-plan when a schedule is added, in case it is due before the current wake-up
+    if scheduler.running:
+        scheduler.add_job(run_due_reminders, 'date', id='reminders', replace_existing=True, misfire_grace_time=None)
+
+subscribe("schedule", on_schedule_added)
 
 def start():
     if not scheduler.running:
+        # Translate the templates up front so reminders don't wait on the translator
+        get_template_translator().prewarm(MESSAGE_TEMPLATES.values(), LANGUAGES)
+        # Tick, dispatch and translation metrics are recorded in this process, so serve them from here
+        serve_metrics()
         scheduler.start()
+        wake()
 
 def recommend_optimal_time(adherence_history, times):
     """
@@ -75,8 +168,9 @@ def recommend_optimal_time(adherence_history, times):
     return max(rates, key=rates.get)
 
 # Example: show recommended time in dashboard (pseudo-code, adapt as needed)
-for patient in patients:
-    history = patient.get('adherence_history', [1, 0, 1, 0, 1, 1])
-    times = patient.get('dose_times', ['8am', '8pm', '8am', '8pm', '8am', '8pm'])
-    recommended_time = recommend_optimal_time(history, times)
-    print(f"Recommended optimal time for {patient['name']}: {recommended_time}") 
\ No newline at end of file
+if __name__ == "__main__":
+    for patient in get_patients():
+        history = patient.get('adherence_history', [1, 0, 1, 0, 1, 1])
+        times = patient.get('dose_times', ['8am', '8pm', '8am', '8pm', '8am', '8pm'])
+        recommended_time = recommend_optimal_time(history, times)
+        print(f"Recommended optimal time for {patient['name']}: {recommended_time}") 
\ No newline at end of file
@@ -0,0 +1,426 @@
+# sharding.py
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from due_queue import DueQueue, load_watermark, save_watermark
+from metrics import METRICS_PORT, serve as serve_metrics
+from outbox import default_worker_id
+from storage import ConnectionPool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shard_leases (
+    shard INTEGER PRIMARY KEY,  -- COORDINATOR (-1) is the coordinator role itself
+    assigned_to TEXT,           -- worker the coordinator wants to own the shard
+    owner TEXT,                 -- worker currently holding the lease
+    expires REAL NOT NULL DEFAULT 0
+);
+"""
+
+COORDINATOR = -1
+DEFAULT_SHARDS = 16
+LEASE_PATH = os.getenv("TIBA_SHARD_LEASES", "shards.db")
+
+
+def shard_of(contact, num_shards):
+    """Stable shard of a patient contact (the same in every process and across restarts)."""
+    return zlib.crc32(str(contact).encode("utf-8")) % num_shards
+
+
+def shard_path(path, shard):
+    """Per-shard variant of a state file path: 'scheduler_state.json' -> 'scheduler_state.shard3.json'."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+class ShardLeases:
+    """
+    Shard ownership in a SQLite file shared by all workers on the box. Workers
+    heartbeat; one of them holds the coordinator lease and assigns shards evenly
+    over the live workers; each worker then leases its assigned shards. Leases
+    expire after lease_seconds without renewal, so the shards (and coordinator
+    role) of a crashed worker are taken over by the others.
+    """
+
+    def __init__(self, path=LEASE_PATH, num_shards=DEFAULT_SHARDS, lease_seconds=15.0):
+        self.pool = ConnectionPool(path, size=2)
+        self.num_shards = num_shards
+        self.lease_seconds = lease_seconds
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute("SELECT COUNT(*) FROM shard_leases WHERE shard >= 0").fetchone()[0]
+            if existing and existing != num_shards:
+                raise ValueError(f"{path} was created with {existing} shards, not {num_shards}")
+            conn.executemany(
+                "INSERT OR IGNORE INTO shard_leases (shard) VALUES (?)",
+                [(shard,) for shard in range(COORDINATOR, num_shards)],
+            )
+
+    def heartbeat(self, worker_id, now=None):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shard_workers (worker_id, heartbeat) VALUES (?, ?)", (worker_id, now or time.time())
+            )
+
+    def live_workers(self, now=None):
+        cutoff = (now or time.time()) - self.lease_seconds
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT worker_id FROM shard_workers WHERE heartbeat >= ? ORDER BY worker_id", (cutoff,)
+            ).fetchall()
+        return [worker_id for (worker_id,) in rows]
+
+    def acquire(self, shard, worker_id, now=None):
+        """Take or renew a lease. Returns False if another worker holds it."""
+        now = now or time.time()
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                "UPDATE shard_leases SET owner = ?, expires = ? "
+                "WHERE shard = ? AND (owner IS NULL OR owner = ? OR expires < ?)",
+                (worker_id, now + self.lease_seconds, shard, worker_id, now),
+            )
+        return cur.rowcount == 1
+
+    @contextmanager
+    def holding(self, shard, worker_id, now=None):
+        """
+        Renew a lease we hold and keep the lease table locked while the block runs,
+        so no other worker can take the shard until it finishes. Yields whether the
+        lease was still ours; keep the block short (other workers' lease calls wait).
+        """
+        now = now or time.time()
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "UPDATE shard_leases SET expires = ? WHERE shard = ? AND owner = ? AND expires >= ?",
+                (now + self.lease_seconds, shard, worker_id, now),
+            )
+            yield cur.rowcount == 1
+
+    def release(self, shard, worker_id):
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE shard_leases SET owner = NULL, expires = 0 WHERE shard = ? AND owner = ?", (shard, worker_id))
+
+    def leave(self, worker_id):
+        """Release everything a worker holds and drop it from the live set."""
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE shard_leases SET owner = NULL, expires = 0 WHERE owner = ?", (worker_id,))
+            conn.execute("DELETE FROM shard_workers WHERE worker_id = ?", (worker_id,))
+
+    def rebalance(self, now=None):
+        """
+        Assign every shard to a live worker, at most ceil(shards / workers) each.
+        Shards stay with their current worker where possible so little moves
+        when a worker joins or leaves. Returns {shard: worker_id}.
+        """
+        live = self.live_workers(now)
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Forget workers that died without leaving
+            conn.execute("DELETE FROM shard_workers WHERE heartbeat < ?", ((now or time.time()) - 10 * self.lease_seconds,))
+            current = dict(conn.execute("SELECT shard, assigned_to FROM shard_leases WHERE shard >= 0").fetchall())
+            assignment = {}
+            if live:
+                cap = -(-self.num_shards // len(live))
+                load = {worker_id: 0 for worker_id in live}
+                for shard, worker_id in sorted(current.items()):
+                    if worker_id in load and load[worker_id] < cap:
+                        assignment[shard] = worker_id
+                        load[worker_id] += 1
+                for shard in sorted(set(current) - set(assignment)):
+                    worker_id = min(live, key=lambda w: (load[w], w))
+                    assignment[shard] = worker_id
+                    load[worker_id] += 1
+            conn.executemany(
+                "UPDATE shard_leases SET assigned_to = ? WHERE shard = ?",
+                [(assignment.get(shard), shard) for shard in current if assignment.get(shard) != current[shard]],
+            )
+        return assignment
+
+    def assigned(self, worker_id):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT shard FROM shard_leases WHERE assigned_to = ? AND shard >= 0 ORDER BY shard", (worker_id,)
+            ).fetchall()
+        return [shard for (shard,) in rows]
+
+    def status(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT shard, assigned_to, owner, expires FROM shard_leases ORDER BY shard").fetchall()
+
+
+class ShardWorker:
+    """
+    Scheduler worker for the shards it leases. Each owned shard has its own due
+    queue, watermark file and bandit checkpoint, so a shard can move to another
+    worker and carry on where the last owner stopped. Reminders go through the
+    shared outbox, whose idempotency keys make a handover that re-pops a dose
+    harmless.
+    """
+
+    def __init__(self, leases, worker_id=None, heartbeat_interval=None, metrics_port=None):
+        self.leases = leases
+        self.metrics_port = metrics_port
+        self.worker_id = worker_id or default_worker_id()
+        self.heartbeat_interval = heartbeat_interval or leases.lease_seconds / 3
+        self.queues = {}  # shard -> DueQueue
+        self.bandits = {}  # shard -> VectorizedBandit
+        self.pending = {}  # assigned shard not leased yet -> its schedules, so taking it needs no rescan
+        self.last_schedule_id = None  # schedules added after this are picked up by poll_schedules
+        self.held = set()  # leases held, renewed by the heartbeat thread
+        self.lost = set()  # shards whose renewal failed, dropped at the next sync
+        self.rate_share = 1  # live workers the dispatcher's rate limits are divided among
+        self.lock = threading.Lock()
+
+    def renew(self, now=None):
+        """Heartbeat and extend the leases we hold. Runs on its own thread so a long tick doesn't lose them."""
+        now = now or time.time()
+        with self.lock:
+            self.leases.heartbeat(self.worker_id, now)
+            for shard in list(self.held):
+                if not self.leases.acquire(shard, self.worker_id, now):
+                    # Lost to another worker: stop ticking it now rather than at the next sync
+                    self.held.discard(shard)
+                    self.lost.add(shard)
+
+    def sync_leases(self, now=None):
+        """Heartbeat, coordinate if we hold that role, and take/drop shards to match the assignment."""
+        import scheduler
+        now = now or time.time()
+        with self.lock:
+            self.leases.heartbeat(self.worker_id, now)
+            # Every worker sends through the same provider accounts, so each gets an equal share of the rate limits
+            live = len(self.leases.live_workers(now))
+            if live != self.rate_share:
+                scheduler.dispatcher.set_rate_share(live)
+                self.rate_share = live
+            if self.leases.acquire(COORDINATOR, self.worker_id, now):
+                self.held.add(COORDINATOR)
+                self.leases.rebalance(now)
+            else:
+                self.held.discard(COORDINATOR)
+            assigned = set(self.leases.assigned(self.worker_id))
+            released, lost = [], sorted(self.lost & set(self.queues))
+            for shard in sorted(set(self.queues) - self.lost):
+                if shard not in assigned:
+                    released.append(shard)
+                elif not self.leases.acquire(shard, self.worker_id, now):
+                    lost.append(shard)  # our lease lapsed and another worker took over
+            self.lost.clear()
+            self.held.difference_update(lost)
+        for shard in released:
+            # Save while the lease is still ours, then let it go
+            saved = self.save_shard(shard)
+            if saved:
+                self.leases.release(shard, self.worker_id)
+            with self.lock:
+                self.held.discard(shard)
+                self.lost.discard(shard)
+            self.drop_shard(shard, "Released" if saved else "Lost")
+        for shard in lost:
+            # The new owner writes this shard's state files now; ours are stale
+            self.drop_shard(shard, "Lost")
+        # Schedules of newly assigned shards are read once, when the assignment changes
+        for shard in set(self.pending) - assigned:
+            del self.pending[shard]
+        self.load_pending(assigned - set(self.queues) - set(self.pending))
+        with self.lock:
+            acquired = [shard for shard in sorted(self.pending) if self.leases.acquire(shard, self.worker_id, now)]
+            self.held.update(acquired)
+        if acquired:
+            self.take_shards(acquired)
+
+    def load_pending(self, shards):
+        """Collect the stored schedules of newly assigned shards in one pass; poll_schedules adds later ones."""
+        from mock_db import data_version, iter_records
+        if not shards:
+            return
+        if self.last_schedule_id is None:
+            self.last_schedule_id = data_version("schedule")[0]
+        for shard in shards:
+            self.pending[shard] = []
+        for rows in iter_records("schedule", 0):
+            for row_id, sched in rows:
+                if row_id > self.last_schedule_id:
+                    return
+                shard = shard_of(sched["patient_contact"], self.leases.num_shards)
+                if shard in shards:
+                    self.pending[shard].append(sched)
+
+    def take_shards(self, shards):
+        import scheduler
+        from mock_db import get_patients_by_contact
+        from reminder_optimization import VectorizedBandit
+        for shard in shards:
+            schedules = self.pending.pop(shard)
+            patients = get_patients_by_contact({sched["patient_contact"] for sched in schedules})
+            queue = DueQueue(load_watermark(shard_path(scheduler.WATERMARK_PATH, shard)))
+            for sched in schedules:
+                queue.add_schedule(sched, patients.get(sched["patient_contact"]))
+            self.queues[shard] = queue
+            bandit = VectorizedBandit(scheduler.arms, strategy=scheduler.bandit.strategy)
+            bandit_path = shard_path(scheduler.BANDIT_PATH, shard)
+            if os.path.exists(bandit_path):
+                bandit.load(bandit_path)
+            self.bandits[shard] = bandit
+        print(f"[SHARD {self.worker_id}] Took shards {shards}")
+
+    def save_shard(self, shard):
+        """
+        Save a shard's watermark if we still hold its lease, checked and renewed in
+        the same transaction so another worker can't take the shard mid-write.
+        Returns False (and marks the shard lost) if the lease has gone.
+        """
+        import scheduler
+        with self.leases.holding(shard, self.worker_id) as held:
+            if held:
+                save_watermark(shard_path(scheduler.WATERMARK_PATH, shard), self.queues[shard].watermark)
+        if not held:
+            with self.lock:
+                self.held.discard(shard)
+                self.lost.add(shard)
+        return held
+
+    def drop_shard(self, shard, reason):
+        self.queues.pop(shard)
+        self.bandits.pop(shard, None)
+        print(f"[SHARD {self.worker_id}] {reason} shard {shard}")
+
+    def poll_schedules(self):
+        """Add schedules written since the last poll (by any process) to the owned and pending shards."""
+        from mock_db import get_patient, iter_records
+        if self.last_schedule_id is None:
+            return  # no shards yet
+        for rows in iter_records("schedule", self.last_schedule_id):
+            for row_id, sched in rows:
+                shard = shard_of(sched["patient_contact"], self.leases.num_shards)
+                if shard in self.queues:
+                    self.queues[shard].add_schedule(sched, get_patient(sched["patient_contact"]))
+                elif shard in self.pending:
+                    self.pending[shard].append(sched)
+                self.last_schedule_id = row_id
+
+    def tick(self, now=None, reward_fn=None):
+        """Send what's due in every owned shard. Returns the number of doses popped."""
+        import scheduler
+        now = now or datetime.now(timezone.utc)
+        popped = 0
+        for shard, queue in list(self.queues.items()):
+            if shard not in self.held:
+                continue  # lease lost since the last sync
+            with scheduler.tick_seconds.time(shard=shard):
+                due = queue.pop_due(now)
+                scheduler.process_due(due, reward_fn, self.bandits[shard], shard_path(scheduler.BANDIT_PATH, shard))
+                self.save_shard(shard)
+            popped += len(due)
+        scheduler.drain(scheduler.outbox, scheduler.dispatcher, self.worker_id)
+        return popped
+
+    def next_due(self):
+        times = [t for t in (queue.next_due() for queue in self.queues.values()) if t is not None]
+        return min(times) if times else None
+
+    def run(self, stop_event=None):
+        """Main loop: keep leases fresh and sleep until the next dose or heartbeat."""
+        import scheduler
+        stop_event = stop_event or threading.Event()
+        scheduler.get_template_translator().prewarm(scheduler.MESSAGE_TEMPLATES.values(), scheduler.LANGUAGES)
+        if self.metrics_port:
+            serve_metrics(self.metrics_port)
+        print(f"[SHARD {self.worker_id}] Worker started")
+        heartbeat_stop = threading.Event()
+
+        def heartbeat_loop():
+            while not heartbeat_stop.wait(self.heartbeat_interval):
+                try:
+                    self.renew()
+                except Exception as e:
+                    print(f"[SHARD ERROR] Heartbeat failed for {self.worker_id}: {e}")
+
+        threading.Thread(target=heartbeat_loop, daemon=True).start()
+        try:
+            while not stop_event.is_set():
+                self.sync_leases()
+                self.poll_schedules()
+                self.tick()
+                wait = self.heartbeat_interval
+                next_due = self.next_due()
+                if next_due is not None:
+                    wait = min(wait, max(0.0, (next_due - datetime.now(timezone.utc)).total_seconds()))
+                stop_event.wait(wait)
+        finally:
+            heartbeat_stop.set()
+            for shard in sorted(self.queues):
+                self.drop_shard(shard, "Released" if self.save_shard(shard) else "Lost")
+            with self.lock:
+                self.held.clear()
+            self.leases.leave(self.worker_id)
+            print(f"[SHARD {self.worker_id}] Worker stopped")
+
+
+def run_worker(path=LEASE_PATH, num_shards=DEFAULT_SHARDS, lease_seconds=15.0, worker_id=None, metrics_port=None):
+    """Run one worker until SIGTERM/SIGINT, serving its metrics on metrics_port if given."""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    leases = ShardLeases(path, num_shards, lease_seconds)
+    ShardWorker(leases, worker_id, metrics_port=metrics_port).run(stop_event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded reminder scheduler.")
+    parser.add_argument("command", choices=["run", "worker", "status"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes to start (run)")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    parser.add_argument("--leases", default=LEASE_PATH, help="SQLite file holding shard leases")
+    parser.add_argument("--lease-seconds", type=float, default=15.0)
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Port for /metrics (worker); with run, worker i uses this port + 1 + i. 0 disables")
+    args = parser.parse_args()
+    if args.command == "status":
+        for shard, assigned_to, owner, expires in ShardLeases(args.leases, args.shards, args.lease_seconds).status():
+            name = "coordinator" if shard == COORDINATOR else f"shard {shard}"
+            live = owner and expires >= time.time()
+            print(f"{name:>12}: assigned to {assigned_to or '-'}, held by {owner if live else '-'}")
+        return
+    if os.getenv("TIBA_STORAGE", "memory") == "memory":
+        print("[SHARD] Warning: TIBA_STORAGE is 'memory', so each worker only sees its own data. Use TIBA_STORAGE=sqlite.")
+    if args.command == "worker":
+        run_worker(args.leases, args.shards, args.lease_seconds, args.worker_id, args.metrics_port)
+        return
+    ShardLeases(args.leases, args.shards, args.lease_seconds)  # create the schema once, before the workers race
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(args.leases, args.shards, args.lease_seconds, f"{default_worker_id()}-{i}",
+                  args.metrics_port and args.metrics_port + 1 + i),
+        )
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# simulator.py
+"""
+Offline load simulator and benchmark for the reminder pipeline.
+
+Generates synthetic patients and schedules, replays a day on a virtual clock
+through scheduler.check_and_send_reminders (due queue, bandit, translation,
+outbox, dispatcher) with a fake transport, and optionally posts each simulated
+reply to the webhook. Every patient has hidden per-arm adherence probabilities,
+so bandit regret can be measured. Runs are deterministic for a given --seed.
+
+    python simulator.py --patients 2000 --latency 0.002
+    python simulator.py --patients 2000 --save-report baseline.json
+    python simulator.py --patients 2000 --baseline baseline.json  # exits 1 on regression
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from due_queue import COUNTRY_TIMEZONES, patient_timezone
+from phone import COUNTRY_CODES
+
+LANGUAGES = ["English", "Swahili", "Kinyarwanda", "Luganda"]
+MEDICATIONS = ["Metformin", "Amlodipine", "Tenofovir", "Isoniazid", "Lisinopril"]
+DOSE_TIMES = ["06:00", "08:00", "12:00", "14:00", "18:00", "20:00", "22:00"]
+# Report fields compared against a baseline: name -> True if higher is better
+BENCHMARK_FIELDS = {"doses_per_second": True, "messages_per_second": True, "tick_p95_ms": False, "peak_memory_mb": False}
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def generate_patients(n, seed=0):
+    """n synthetic (patient, schedules) pairs, the same for a given seed."""
+    rng = random.Random(seed)
+    countries = list(COUNTRY_TIMEZONES)
+    result = []
+    for i in range(n):
+        country = rng.choice(countries)
+        patient = {
+            "name": f"Patient {i}",
+            "contact": f"+{COUNTRY_CODES[country]}7{i:08d}",
+            "language": rng.choice(LANGUAGES),
+            "country": country,
+            "adherence_history": [int(rng.random() < 0.8) for _ in range(7)],
+        }
+        schedules = [
+            {
+                "patient_contact": patient["contact"],
+                "medication": medication,
+                "schedule": ", ".join(sorted(rng.sample(DOSE_TIMES, rng.randint(1, 3)))),
+            }
+            for medication in rng.sample(MEDICATIONS, rng.randint(1, 2))
+        ]
+        result.append((patient, schedules))
+    return result
+
+
+class ResponseModel:
+    """
+    Hidden adherence probability of every patient for every arm: a base rate plus
+    a boost on one preferred arm. Draws are seeded, so replays are reproducible.
+    """
+
+    def __init__(self, contacts, n_arms, seed=0):
+        rng = np.random.default_rng(seed)
+        base = rng.uniform(0.3, 0.7, size=(len(contacts), 1))
+        self.probs = np.clip(base + rng.uniform(-0.1, 0.1, size=(len(contacts), n_arms)), 0, 1)
+        preferred = rng.integers(0, n_arms, size=len(contacts))
+        self.probs[np.arange(len(contacts)), preferred] = np.clip(base[:, 0] + 0.25, 0, 1)
+        self.rows = {contact: i for i, contact in enumerate(contacts)}
+        self.random = random.Random(seed)
+        self.decisions = 0
+        self.optimal = 0
+        self.regret = 0.0
+
+    def __call__(self, patient, arm_index):
+        p = self.probs[self.rows[patient["contact"]]]
+        self.decisions += 1
+        self.optimal += int(p[arm_index] == p.max())
+        self.regret += float(p.max() - p[arm_index])  # expected regret of this choice
+        return int(self.random.random() < p[arm_index])
+
+
+def run_simulation(patients=1000, hours=24, seed=0, latency=0.0, failure_rate=0.0, strategy="thompson",
+                   webhook=True, trace_memory=True, workdir=None, production_rates=False):
+    """
+    Replay 'hours' of reminders for 'patients' synthetic patients. Returns a report dict.
+    Rate limits and retry backoff are lifted so the run measures the pipeline; the
+    dispatcher sleeps in real time, so with production_rates (dispatcher.DEFAULT_RATES)
+    the slowest channel's limit sets the pace instead.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="tiba-sim-")
+    # Isolated, in-memory state: must be set before the pipeline modules are imported
+    os.environ.update({
+        "TIBA_STORAGE": "memory",
+        "TIBA_TRANSLATOR": "stub",
+        "TIBA_OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "TIBA_WATERMARK_PATH": os.path.join(workdir, "scheduler_state.json"),
+        "TIBA_BANDIT_PATH": os.path.join(workdir, "bandit_state.npz"),
+        "TIBA_TRANSLATION_CACHE": os.path.join(workdir, "translations.db"),
+    })
+    import mock_db
+    import scheduler
+    from dispatcher import Dispatcher, FakeTransport
+    from reminder_optimization import VectorizedBandit
+
+    random.seed(seed)  # dispatcher retry jitter
+    population = generate_patients(patients, seed)
+    for patient, schedules in population:
+        mock_db.add_patient(patient)
+        for sched in schedules:
+            mock_db.add_schedule(sched)
+    model = ResponseModel([patient["contact"] for patient, _ in population], len(scheduler.arms), seed)
+    transport = FakeTransport(latency=latency, failure_rate=failure_rate, seed=seed)
+    if production_rates:
+        scheduler.dispatcher = Dispatcher(transport)
+    else:
+        scheduler.dispatcher = Dispatcher(transport, rates={channel: 1e9 for channel in scheduler.CHANNELS}, backoff=0.0)
+    scheduler.bandit = VectorizedBandit(scheduler.arms, strategy=strategy, seed=seed)
+
+    reward_fn = model
+    webhook_latencies = []
+    if webhook:
+        import webhook as webhook_module
+        from ingest import get_ingestor
+        client = webhook_module.app.test_client()
+
+        def reward_fn(patient, arm_index):
+            reward = model(patient, arm_index)
+            started = time.perf_counter()
+            client.post("/feedback", data={"From": patient["contact"], "Body": "yes" if reward else "no"})
+            webhook_latencies.append(time.perf_counter() - started)
+            return reward
+
+    # Virtual clock: local midnight in Nairobi on a fixed date
+    start = datetime(2025, 1, 6, tzinfo=patient_timezone(None)).astimezone(timezone.utc)
+    end = start + timedelta(hours=hours)
+    scheduler.due_queue = scheduler.build_due_queue(start)
+
+    if trace_memory:
+        tracemalloc.start()
+    tick_latencies = []
+    wall_started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while True:
+            now = scheduler.due_queue.next_due()
+            if now is None or now > end:
+                break
+            started = time.perf_counter()
+            scheduler.check_and_send_reminders(now, reward_fn=reward_fn)
+            tick_latencies.append(time.perf_counter() - started)
+        if webhook:
+            get_ingestor().flush()
+    wall = time.perf_counter() - wall_started
+    peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+    scheduler.dispatcher.shutdown()
+
+    outbox_stats = scheduler.outbox.stats()
+    report = {
+        "patients": patients,
+        "schedules": sum(len(schedules) for _, schedules in population),
+        "hours": hours,
+        "seed": seed,
+        "strategy": strategy,
+        "production_rates": production_rates,
+        "ticks": len(tick_latencies),
+        "doses": model.decisions,
+        "messages_sent": len(transport.sent),
+        "outbox": outbox_stats,
+        "wall_seconds": wall,
+        "doses_per_second": model.decisions / wall if wall else 0.0,
+        "messages_per_second": len(transport.sent) / wall if wall else 0.0,
+        "tick_p50_ms": percentile_ms(tick_latencies, 50),
+        "tick_p95_ms": percentile_ms(tick_latencies, 95),
+        "tick_p99_ms": percentile_ms(tick_latencies, 99),
+        "tick_max_ms": max(tick_latencies, default=0.0) * 1000,
+        "webhook_p50_ms": percentile_ms(webhook_latencies, 50),
+        "webhook_p99_ms": percentile_ms(webhook_latencies, 99),
+        "feedback_records": len(mock_db.get_feedback()),
+        "peak_memory_mb": peak_memory / 2**20 if peak_memory is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "bandit_regret": model.regret,
+        "bandit_regret_per_dose": model.regret / model.decisions if model.decisions else 0.0,
+        "optimal_arm_rate": model.optimal / model.decisions if model.decisions else 0.0,
+    }
+    return report
+
+
+def compare_reports(report, baseline, tolerance=0.2):
+    """Benchmark fields more than 'tolerance' worse than the baseline, as messages."""
+    regressions = []
+    if bool(report.get("production_rates")) != bool(baseline.get("production_rates")):
+        regressions.append("production_rates differs from the baseline run; the reports aren't comparable")
+    for field, higher_is_better in BENCHMARK_FIELDS.items():
+        new, old = report.get(field), baseline.get(field)
+        if not new or not old:
+            continue
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > tolerance:
+            regressions.append(f"{field}: {old:.2f} -> {new:.2f} ({change:.0%} worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a simulated day through the reminder pipeline.")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Fake transport latency per message (seconds)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--strategy", default="thompson", choices=["epsilon", "ucb", "thompson"])
+    parser.add_argument("--no-webhook", action="store_true", help="Don't post simulated replies to the webhook")
+    parser.add_argument("--production-rates", action="store_true",
+                        help="Send at the dispatcher's real per-channel rate limits (real time; the slowest channel sets the pace)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip memory tracing (it slows the run)")
+    parser.add_argument("--save-report", help="Write the report as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a saved report and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run_simulation(args.patients, args.hours, args.seed, args.latency, args.failure_rate, args.strategy,
+                            webhook=not args.no_webhook, trace_memory=not args.no_tracemalloc,
+                            production_rates=args.production_rates)
+    for key, value in report.items():
+        print(f"{key:>24}: {value:.3f}" if isinstance(value, float) else f"{key:>24}: {value}")
+    if args.save_report:
+        with open(args.save_report, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
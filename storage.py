@@ -0,0 +1,431 @@
+# storage.py
+import bisect
+import json
+import queue
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+
+from phone import normalize_phone
+
+
+# Helper to parse schedule times (e.g., '8:00, 20:00')
+def parse_times(times_str):
+    return [t.strip() for t in times_str.split(",") if t.strip()]
+
+
+def minute_of_day(time_str):
+    """Convert an 'HH:MM' string to minutes since midnight, or None if it can't be parsed."""
+    try:
+        hour, minute = time_str.split(":")
+        hour, minute = int(hour), int(minute)
+    except ValueError:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return hour * 60 + minute
+
+
+def patient_phone(patient):
+    """E.164 form of a patient's contact, used as the phone lookup key."""
+    return normalize_phone(patient.get("contact"), patient.get("country")) or patient.get("contact")
+
+
+def schedule_minutes(schedule):
+    minutes = (minute_of_day(t) for t in parse_times(schedule["schedule"]))
+    return sorted({m for m in minutes if m is not None})
+
+
+class MemoryStorage:
+    """
+    In-memory storage engine: plain lists plus hash/sorted indexes.
+    Data is lost on restart; this is the default for demos and testing.
+    """
+
+    def __init__(self):
+        self.patients = []
+        self.schedules = []
+        self.feedback_log = []
+        self.lock = threading.RLock()
+        self.patient_index = {}  # contact -> patient
+        self.phone_index = {}  # E.164 phone -> patient
+        self.schedules_by_contact = defaultdict(list)
+        self.feedback_by_contact = defaultdict(list)
+        self.feedback_by_medication = defaultdict(list)
+        self.feedback_times = []  # sorted (timestamp, seq) keys
+        self.feedback_by_time = []  # feedback in the same order as feedback_times
+
+    def add_patient(self, patient):
+        self.add_patients_many([patient])
+        return patient
+
+    def add_patients_many(self, patients):
+        with self.lock:
+            for patient in patients:
+                self.patients.append(patient)
+                self.patient_index[patient["contact"]] = patient
+                self.phone_index[patient_phone(patient)] = patient
+        return patients
+
+    def get_patients(self):
+        return self.patients
+
+    def get_patient(self, contact):
+        return self.patient_index.get(contact)
+
+    def get_patient_by_phone(self, phone):
+        return self.phone_index.get(phone)
+
+    def get_patients_by_contact(self, contacts):
+        return {contact: self.patient_index[contact] for contact in contacts if contact in self.patient_index}
+
+    def add_schedule(self, schedule):
+        self.add_schedules_many([schedule])
+        return schedule
+
+    def add_schedules_many(self, schedules):
+        with self.lock:
+            for schedule in schedules:
+                self.schedules.append(schedule)
+                self.schedules_by_contact[schedule["patient_contact"]].append(schedule)
+        return schedules
+
+    def get_schedules(self, patient_contact=None):
+        if patient_contact:
+            return self.schedules_by_contact.get(patient_contact, [])
+        return self.schedules
+
+    def get_schedules_by_contact(self, contacts):
+        return {contact: list(self.schedules_by_contact[contact]) for contact in contacts if contact in self.schedules_by_contact}
+
+    def _records(self, kind):
+        return {"patient": self.patients, "schedule": self.schedules, "feedback": self.feedback_log}[kind]
+
+    def version(self, kind):
+        # Records are append-only, so the count only ever increases
+        return len(self._records(kind))
+
+    def iter_records(self, kind, after_id=0, chunk_size=10000):
+        """Yield lists of (id, record) with id > after_id, oldest first; ids are 1-based positions."""
+        records = self._records(kind)
+        for start in range(after_id, len(records), chunk_size):
+            yield [(start + i + 1, record) for i, record in enumerate(records[start:start + chunk_size])]
+
+    def add_feedback(self, feedback):
+        self.add_feedback_many([feedback])
+        return feedback
+
+    def add_feedback_many(self, feedbacks):
+        with self.lock:
+            for feedback in feedbacks:
+                self.feedback_log.append(feedback)
+                self.feedback_by_contact[feedback["patient_contact"]].append(feedback)
+                self.feedback_by_medication[feedback.get("medication")].append(feedback)
+                key = (str(feedback.get("timestamp", "")), len(self.feedback_log))
+                pos = bisect.bisect(self.feedback_times, key)
+                self.feedback_times.insert(pos, key)
+                self.feedback_by_time.insert(pos, feedback)
+        return feedbacks
+
+    def get_feedback(self, patient_contact=None, medication=None, since=None):
+        if patient_contact:
+            result = self.feedback_by_contact.get(patient_contact, [])
+        elif medication:
+            result = self.feedback_by_medication.get(medication, [])
+        elif since:
+            pos = bisect.bisect_left(self.feedback_times, (since,))
+            return self.feedback_by_time[pos:]
+        else:
+            return self.feedback_log
+        if medication:
+            result = [f for f in result if f.get("medication") == medication]
+        if since:
+            result = [f for f in result if str(f.get("timestamp", "")) >= since]
+        return result
+
+    def _feedback_matches(self, medication, contacts):
+        # Newest first
+        log = self.feedback_by_medication.get(medication, []) if medication else self.feedback_log
+        matches = reversed(log)
+        if contacts is not None:
+            contacts = set(contacts)
+            matches = (f for f in matches if f["patient_contact"] in contacts)
+        return matches
+
+    def get_feedback_page(self, limit, offset=0, medication=None, contacts=None):
+        return list(islice(self._feedback_matches(medication, contacts), offset, offset + limit))
+
+    def count_feedback(self, medication=None, contacts=None):
+        if contacts is None:
+            return len(self.feedback_by_medication.get(medication, []) if medication else self.feedback_log)
+        return sum(1 for _ in self._feedback_matches(medication, contacts))
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections shared by every thread in the process
+    (Streamlit script runs, Flask request handlers and the APScheduler thread).
+    """
+
+    def __init__(self, path, size=5, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self.pool = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self.pool.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get(timeout=self.timeout)
+        try:
+            with conn:  # commits on success, rolls back on error
+                yield conn
+        finally:
+            self.pool.put(conn)
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    contact TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_patients_contact ON patients (contact);
+
+CREATE TABLE IF NOT EXISTS patient_phones (
+    phone TEXT NOT NULL,
+    patient_id INTEGER NOT NULL REFERENCES patients (id)
+);
+CREATE INDEX IF NOT EXISTS idx_patient_phones_phone ON patient_phones (phone);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY,
+    patient_contact TEXT NOT NULL,
+    medication TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_schedules_contact ON schedules (patient_contact);
+CREATE INDEX IF NOT EXISTS idx_schedules_medication ON schedules (medication);
+
+-- Minute-of-day index of older versions; the scheduler's due queue replaced it
+DROP TABLE IF EXISTS schedule_times;
+
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY,
+    patient_contact TEXT NOT NULL,
+    medication TEXT,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_contact ON feedback (patient_contact, timestamp);
+CREATE INDEX IF NOT EXISTS idx_feedback_medication ON feedback (medication, timestamp);
+CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback (timestamp);
+"""
+
+TABLES = {"patient": "patients", "schedule": "schedules", "feedback": "feedback"}
+
+
+class SQLiteStorage:
+    """
+    Persistent storage engine backed by SQLite in WAL mode. Records are stored as
+    JSON with the lookup fields pulled out into indexed columns, so per-patient,
+    per-medication and time-range queries are B-tree lookups instead of scans.
+    Several processes (app, webhook, scheduler) can open the same file.
+    """
+
+    def __init__(self, path="tiba.db", pool_size=5):
+        self.pool = ConnectionPool(path, size=pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+            # Index phones of patients stored before the phone index existed
+            rows = conn.execute(
+                "SELECT id, data FROM patients WHERE id NOT IN (SELECT patient_id FROM patient_phones)"
+            ).fetchall()
+            conn.executemany(
+                "INSERT INTO patient_phones (phone, patient_id) VALUES (?, ?)",
+                [(patient_phone(json.loads(data)), patient_id) for patient_id, data in rows],
+            )
+
+    def add_patient(self, patient):
+        self.add_patients_many([patient])
+        return patient
+
+    def add_patients_many(self, patients):
+        # One transaction for the whole batch
+        with self.pool.connection() as conn:
+            for patient in patients:
+                cur = conn.execute(
+                    "INSERT INTO patients (contact, data) VALUES (?, ?)",
+                    (patient["contact"], json.dumps(patient, default=str)),
+                )
+                conn.execute(
+                    "INSERT INTO patient_phones (phone, patient_id) VALUES (?, ?)",
+                    (patient_phone(patient), cur.lastrowid),
+                )
+        return patients
+
+    def get_patients(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT data FROM patients ORDER BY id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def get_patient(self, contact):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT data FROM patients WHERE contact = ? ORDER BY id DESC LIMIT 1", (contact,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_patient_by_phone(self, phone):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT p.data FROM patient_phones ph JOIN patients p ON p.id = ph.patient_id "
+                "WHERE ph.phone = ? ORDER BY p.id DESC LIMIT 1",
+                (phone,),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_patients_by_contact(self, contacts):
+        """Latest record of each stored contact in 'contacts', in one query."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT contact, data FROM patients WHERE contact IN (SELECT value FROM json_each(?)) ORDER BY id",
+                (json.dumps(list(contacts)),),
+            ).fetchall()
+        return {contact: json.loads(data) for contact, data in rows}
+
+    def add_schedule(self, schedule):
+        self.add_schedules_many([schedule])
+        return schedule
+
+    def add_schedules_many(self, schedules):
+        # One transaction for the whole batch
+        with self.pool.connection() as conn:
+            for schedule in schedules:
+                conn.execute(
+                    "INSERT INTO schedules (patient_contact, medication, data) VALUES (?, ?, ?)",
+                    (schedule["patient_contact"], schedule.get("medication"), json.dumps(schedule, default=str)),
+                )
+        return schedules
+
+    def get_schedules(self, patient_contact=None):
+        with self.pool.connection() as conn:
+            if patient_contact:
+                rows = conn.execute(
+                    "SELECT data FROM schedules WHERE patient_contact = ? ORDER BY id", (patient_contact,)
+                ).fetchall()
+            else:
+                rows = conn.execute("SELECT data FROM schedules ORDER BY id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def get_schedules_by_contact(self, contacts):
+        """contact -> schedules for each contact in 'contacts' that has any, in one query."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT patient_contact, data FROM schedules "
+                "WHERE patient_contact IN (SELECT value FROM json_each(?)) ORDER BY id",
+                (json.dumps(list(contacts)),),
+            ).fetchall()
+        schedules = defaultdict(list)
+        for contact, data in rows:
+            schedules[contact].append(json.loads(data))
+        return dict(schedules)
+
+    def version(self, kind):
+        # Highest row id: increases with every insert, from any process sharing the file
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLES[kind]}").fetchone()[0]
+
+    def iter_records(self, kind, after_id=0, chunk_size=10000):
+        """Yield lists of (id, record) with id > after_id, oldest first, one query per chunk."""
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT id, data FROM {TABLES[kind]} WHERE id > ? ORDER BY id LIMIT ?", (after_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [(row_id, json.loads(data)) for row_id, data in rows]
+            after_id = rows[-1][0]
+
+    def add_feedback(self, feedback):
+        self.add_feedback_many([feedback])
+        return feedback
+
+    def add_feedback_many(self, feedbacks):
+        # One transaction for the whole batch
+        with self.pool.connection() as conn:
+            conn.executemany(
+                "INSERT INTO feedback (patient_contact, medication, timestamp, data) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        feedback["patient_contact"],
+                        feedback.get("medication"),
+                        str(feedback.get("timestamp", "")),
+                        json.dumps(feedback, default=str),
+                    )
+                    for feedback in feedbacks
+                ],
+            )
+        return feedbacks
+
+    def get_feedback(self, patient_contact=None, medication=None, since=None):
+        clauses, params = [], []
+        if patient_contact:
+            clauses.append("patient_contact = ?")
+            params.append(patient_contact)
+        if medication:
+            clauses.append("medication = ?")
+            params.append(medication)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "timestamp, id" if since else "id"
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT data FROM feedback{where} ORDER BY {order}", params).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def _feedback_filter(self, medication, contacts):
+        clauses, params = [], []
+        if medication:
+            clauses.append("medication = ?")
+            params.append(medication)
+        if contacts is not None:
+            clauses.append("patient_contact IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(contacts)))
+        return (f" WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def get_feedback_page(self, limit, offset=0, medication=None, contacts=None):
+        where, params = self._feedback_filter(medication, contacts)
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT data FROM feedback{where} ORDER BY id DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def count_feedback(self, medication=None, contacts=None):
+        where, params = self._feedback_filter(medication, contacts)
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM feedback{where}", params).fetchone()[0]
+
+
+def open_storage(engine="memory", path="tiba.db"):
+    """Create a storage engine by name ('memory' or 'sqlite')."""
+    if engine == "memory":
+        return MemoryStorage()
+    if engine == "sqlite":
+        return SQLiteStorage(path)
+    raise ValueError(f"Unknown storage engine: {engine}")
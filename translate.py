@@ -1,19 +1,212 @@
 # translate.py
-from deep_translator import GoogleTranslator
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def translate(text, target='sw'):
-    return GoogleTranslator(source='auto', target=target).translate(text)
+from metrics import counter
+
+LANG_MAP = {
+    "Swahili": "sw",
+    "Kinyarwanda": "rw",
+    "Luganda": "lg",
+    "English": "en"
+}
+
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+cache_hits = counter("tiba_translation_cache_hits_total", "Rendered templates served from the translation cache")
+cache_misses = counter("tiba_translation_cache_misses_total", "Rendered templates not in the translation cache")
+# After a failed translation, the untranslated template is used for this long before trying again
+RETRY_SECONDS = float(os.getenv("TIBA_TRANSLATION_RETRY_SECONDS", "300"))
+
+
+class GoogleBackend:
+    """Google Translate via deep_translator (network round trip per call)."""
+
+    def translate(self, text, dest):
+        from deep_translator import GoogleTranslator
+        return GoogleTranslator(source='auto', target=dest).translate(text)
+
+
+class StubBackend:
+    """Offline backend for tests and demos: tags the text with the target language."""
+
+    def translate(self, text, dest):
+        return text if dest == "en" else f"[{dest}] {text}"
+
+
+def get_backend(name=None):
+    name = name or os.getenv("TIBA_TRANSLATOR", "google")
+    if name == "stub":
+        return StubBackend()
+    return GoogleBackend()
+
+
+def language_code(language):
+    """Map a language name ('Swahili') or code ('sw') to a translator code."""
+    return LANG_MAP.get(language, language)
+
+
+def translate(text, target='sw', backend=None):
     try:
-        translator = Translator()
-        lang_map = {
-            "Swahili": "sw",
-            "Kinyarwanda": "rw",
-            "Luganda": "lg",
-            "English": "en"
-        }
-        dest = lang_map.get(target_language, "en")
-        translated = translator.translate(text, dest=dest)
-        return translated.text
+        return (backend or get_backend()).translate(text, language_code(target))
     except Exception as e:
         print(f"[TRANSLATE ERROR] {e}")
-        return text 
\ No newline at end of file
+        return text
+
+
+class TranslationCache:
+    """
+    Translated templates keyed by (template, language code), held in an in-memory
+    LRU and persisted to a SQLite file so they survive restarts.
+    """
+
+    def __init__(self, path="translations.db", max_entries=5000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (template, lang) -> translation
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "template TEXT, lang TEXT, translation TEXT, last_used REAL, PRIMARY KEY (template, lang))"
+        )
+        rows = self.conn.execute(
+            "SELECT template, lang, translation FROM translations ORDER BY last_used DESC LIMIT ?", (max_entries,)
+        ).fetchall()
+        for template, lang, translation in reversed(rows):
+            self.entries[(template, lang)] = translation
+
+    def get(self, template, lang):
+        with self.lock:
+            translation = self.entries.get((template, lang))
+            if translation is not None:
+                self.entries.move_to_end((template, lang))
+        return translation
+
+    def put(self, template, lang, translation):
+        with self.lock, self.conn:
+            self.entries[(template, lang)] = translation
+            self.entries.move_to_end((template, lang))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", (template, lang, translation, time.time())
+            )
+            while len(self.entries) > self.max_entries:
+                (old_template, old_lang), _ = self.entries.popitem(last=False)
+                self.conn.execute(
+                    "DELETE FROM translations WHERE template = ? AND lang = ?", (old_template, old_lang)
+                )
+
+
+class TemplateTranslator:
+    """
+    Translates parameterized message templates ("Hello {name}, ...") once per
+    (template, language) and fills in the parameters locally. On a cache miss
+    render() never waits for the translator: it returns the untranslated message
+    and translates the template in the background for next time. A failed
+    translation falls back to the untranslated template for RETRY_SECONDS before
+    the translator is asked again.
+    """
+
+    def __init__(self, cache=None, backend=None, workers=2):
+        self.cache = cache or TranslationCache(os.getenv("TIBA_TRANSLATION_CACHE", "translations.db"))
+        self.backend = backend or get_backend()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = set()
+        self.failed = {}  # (template, lang) -> monotonic time to retry a failed translation
+        self.lock = threading.Lock()
+
+    def _failed_recently(self, template, lang):
+        with self.lock:
+            retry_at = self.failed.get((template, lang))
+            if retry_at is not None and time.monotonic() >= retry_at:
+                del self.failed[(template, lang)]
+                retry_at = None
+        return retry_at is not None
+
+    def _fail(self, template, lang):
+        with self.lock:
+            self.failed[(template, lang)] = time.monotonic() + RETRY_SECONDS
+        return template
+
+    def translate_template(self, template, language):
+        """Translate a template now (blocking) and cache it. Returns the translated template."""
+        lang = language_code(language)
+        cached = self.cache.get(template, lang)
+        if cached is not None:
+            return cached
+        if self._failed_recently(template, lang):
+            return template
+        if lang == "en":
+            translated = template
+        else:
+            # Swap placeholders for tokens the translator leaves alone
+            names = PLACEHOLDER.findall(template)
+            protected = template
+            for i, name in enumerate(names):
+                protected = protected.replace("{" + name + "}", f"__{i}__", 1)
+            try:
+                translated = self.backend.translate(protected, lang)
+                if not isinstance(translated, str):
+                    raise ValueError(f"translator returned {translated!r}")
+                for i, name in enumerate(names):
+                    translated = translated.replace(f"__{i}__", "{" + name + "}")
+            except Exception as e:
+                print(f"[TRANSLATE ERROR] {e}")
+                return self._fail(template, lang)
+            # A translator that mangled a token would leave render() without a field; don't cache that
+            if sorted(PLACEHOLDER.findall(translated)) != sorted(names):
+                print(f"[TRANSLATE ERROR] Placeholders lost translating to {lang}: {template!r}")
+                return self._fail(template, lang)
+        self.cache.put(template, lang, translated)
+        return translated
+
+    def _translate_in_background(self, template, language):
+        try:
+            self.translate_template(template, language)
+        finally:
+            with self.lock:
+                self.pending.discard((template, language))
+
+    def prewarm(self, templates, languages):
+        """Queue background translation of every (template, language) pair."""
+        for template in templates:
+            for language in languages:
+                self._schedule(template, language)
+
+    def _schedule(self, template, language):
+        with self.lock:
+            if (template, language) in self.pending:
+                return
+            self.pending.add((template, language))
+        self.executor.submit(self._translate_in_background, template, language)
+
+    def render(self, template, language, **params):
+        """Fill a template in the given language without blocking on the translator."""
+        lang = language_code(language)
+        translated = self.cache.get(template, lang)
+        (cache_hits if translated is not None else cache_misses).inc(lang=lang)
+        if translated is None:
+            if not self._failed_recently(template, lang):
+                self._schedule(template, language)
+            translated = template
+        return PLACEHOLDER.sub(lambda m: str(params.get(m.group(1), m.group(0))), translated)
+
+
+_default_translator = None
+_default_lock = threading.Lock()
+
+
+def get_template_translator():
+    global _default_translator
+    with _default_lock:
+        if _default_translator is None:
+            _default_translator = TemplateTranslator()
+        return _default_translator
+
+
+def render_message(template, language, **params):
+    return get_template_translator().render(template, language, **params)
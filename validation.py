@@ -0,0 +1,118 @@
+# validation.py
+from datetime import date, datetime, time
+
+from phone import normalize_phone
+from storage import minute_of_day, parse_times
+
+# Supported countries and languages
+COUNTRIES = ["Kenya", "Uganda", "Tanzania", "Rwanda"]
+LANGUAGES = ["English", "Swahili", "Kinyarwanda", "Luganda"]
+
+
+def _blank(value):
+    return value is None or (isinstance(value, float) and value != value) or str(value).strip() == ""
+
+
+def _schedule_string(value):
+    """'08:00', '8:00, 20:00' or a datetime.time -> normalized '08:00, 20:00', or None."""
+    if isinstance(value, time):
+        return f"{value.hour:02d}:{value.minute:02d}"
+    minutes = [minute_of_day(t) for t in parse_times(str(value))]
+    if not minutes or None in minutes:
+        return None
+    return ", ".join(f"{m // 60:02d}:{m % 60:02d}" for m in minutes)
+
+
+def _start_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
+
+
+def _whole_number(value, low, high):
+    try:
+        number = int(float(value))
+    except (TypeError, ValueError):
+        return None
+    return number if low <= number <= high else None
+
+
+def validate_registration(record):
+    """
+    Validate one registration (the Register form or a bulk import row) with fields
+    name, contact, country, language, medication, time, start_date, age and
+    num_medications. The phone number is normalized to E.164.
+    Returns (patient, schedule, errors); patient and schedule are None if there are errors.
+    """
+    errors = []
+    name = "" if _blank(record.get("name")) else str(record["name"]).strip()
+    if not name:
+        errors.append("Patient Name is required.")
+    country = "" if _blank(record.get("country")) else str(record["country"]).strip()
+    if not country:
+        errors.append("Country is required.")
+    elif country not in COUNTRIES:
+        errors.append(f"Country must be one of {', '.join(COUNTRIES)}.")
+    contact = None
+    if _blank(record.get("contact")):
+        errors.append("Phone Number is required.")
+    else:
+        contact = normalize_phone(record["contact"], country or None)
+        if contact is None:
+            errors.append(f"Phone Number '{record['contact']}' is not a valid number.")
+    language = "" if _blank(record.get("language")) else str(record["language"]).strip()
+    if not language:
+        errors.append("Language is required.")
+    elif language not in LANGUAGES:
+        errors.append(f"Language must be one of {', '.join(LANGUAGES)}.")
+    medication = "" if _blank(record.get("medication")) else str(record["medication"]).strip()
+    if not medication:
+        errors.append("Medication name is required.")
+    schedule = None
+    if _blank(record.get("time")):
+        errors.append("Time is required.")
+    else:
+        schedule = _schedule_string(record["time"])
+        if schedule is None:
+            errors.append(f"Time '{record['time']}' must be HH:MM (24-hour), comma-separated for several doses.")
+    start_date = None
+    if _blank(record.get("start_date")):
+        errors.append("Start Date is required.")
+    else:
+        start_date = _start_date(record["start_date"])
+        if start_date is None:
+            errors.append(f"Start Date '{record['start_date']}' must be YYYY-MM-DD.")
+    age = None
+    if not _blank(record.get("age")):
+        age = _whole_number(record["age"], 0, 120)
+        if age is None:
+            errors.append("Age must be a whole number from 0 to 120.")
+    num_medications = 1
+    if not _blank(record.get("num_medications")):
+        num_medications = _whole_number(record["num_medications"], 1, 20)
+        if num_medications is None:
+            errors.append("Number of Medications must be a whole number from 1 to 20.")
+    if errors:
+        return None, None, errors
+
+    patient = {
+        "name": name,
+        "contact": contact,
+        "country": country,
+        "language": language,
+    }
+    if age is not None:
+        patient["age"] = age
+    patient["num_medications"] = num_medications
+    sched = {
+        "patient_contact": contact,
+        "medication": medication,
+        "schedule": schedule,
+        "start_date": str(start_date),
+    }
+    return patient, sched, []
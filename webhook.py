@@ -1,31 +1,56 @@
 from flask import Flask, request, Response
-from mock_db import add_feedback, get_patients, get_schedules
+from mock_db import get_patient_by_phone, get_schedules
+from ingest import get_ingestor
+from phone import normalize_phone
+from metrics import counter, histogram, render
+from dose_index import current_slot
 import datetime
 
 app = Flask(__name__)
 
+webhook_seconds = histogram("tiba_webhook_seconds", "Time to handle one inbound feedback message")
+feedback_received = counter("tiba_feedback_received_total", "Inbound feedback messages by outcome")
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition format
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/feedback', methods=['POST'])
+@webhook_seconds.time()
 def feedback():
     from_number = request.form.get('From')
     body = request.form.get('Body', '').strip().lower()
-    # Try to match patient by phone number
-    patient = next((p for p in get_patients() if p['contact'] in from_number), None)
+    # Match patient by E.164 phone number through the phone index
+    patient = get_patient_by_phone(normalize_phone(from_number))
     if not patient:
+        feedback_received.inc(outcome="unknown_patient")
         return Response('<Response><Message>Patient not found.</Message></Response>', mimetype='text/xml')
     # Try to match medication (optional: could parse from message)
-    schedules = [s for s in get_schedules() if s['patient_contact'] == patient['contact']]
+    schedules = get_schedules(patient['contact'])
     if not schedules:
+        feedback_received.inc(outcome="no_schedule")
         return Response('<Response><Message>No medication schedule found.</Message></Response>', mimetype='text/xml')
     # For simplicity, log feedback for all medications for this patient
-    for sched in schedules:
-        feedback = {
+    timestamp = datetime.datetime.now().isoformat()
+    response = body if body in ['yes', 'no', 'delay'] else 'unknown'
+    records = [
+        {
             'patient_contact': patient['contact'],
             'medication': sched['medication'],
-            'timestamp': datetime.datetime.now().isoformat(),
-            'response': body if body in ['yes', 'no', 'delay'] else 'unknown',
+            'timestamp': timestamp,
+            'response': response,
+            'slot': current_slot(sched),
         }
-        add_feedback(feedback)
+        for sched in schedules
+    ]
+    # Written to storage in batches by a background thread
+    get_ingestor().submit(records)
+    feedback_received.inc(outcome=response)
     return Response('<Response><Message>Thank you for your feedback!</Message></Response>', mimetype='text/xml')
 
 if __name__ == '__main__':
-    app.run(port=5000) 
\ No newline at end of file
+    # Keep the adherence model learning from the replies this webhook receives
+    from online_learning import get_learner
+    get_learner()
+    app.run(port=5000)
\ No newline at end of file